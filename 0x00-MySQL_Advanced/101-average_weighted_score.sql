@@ -1,67 +1,59 @@
 -- Create a stored procedure ComputeAverageWeightedScoreForUsers that computes and stores the average weighted score for all students.
 
--- Drop the procedure if it already exists
+-- Drop the procedures if they already exist
 DROP PROCEDURE IF EXISTS ComputeAverageWeightedScoreForUsers;
+DROP PROCEDURE IF EXISTS ComputeAverageWeightedScoreForUsersInBatches;
 
 -- Delimiter to handle the procedure creation
 DELIMITER //
 
--- Create the procedure
-CREATE PROCEDURE ComputeAverageWeightedScoreForUsers()
+-- Create the batched procedure: one set-based UPDATE per range of batch_size user ids,
+-- each committed on its own so that row locks stay short on large tables
+CREATE PROCEDURE ComputeAverageWeightedScoreForUsersInBatches(IN batch_size INT)
 BEGIN
-    DECLARE done INT DEFAULT FALSE;
-    DECLARE user_id INT;
-    DECLARE total_score FLOAT;
     DECLARE total_weight INT;
-    DECLARE avg_score FLOAT;
-
-    -- Cursor to iterate over users
-    DECLARE cur CURSOR FOR SELECT id FROM users;
-    DECLARE CONTINUE HANDLER FOR NOT FOUND SET done = TRUE;
-
-    -- Open the cursor
-    OPEN cur;
-
-    -- Start processing each user
-    user_loop: LOOP
-        -- Fetch the next user ID
-        FETCH cur INTO user_id;
-        IF done THEN
-            LEAVE user_loop;
-        END IF;
-
-        -- Initialize total score and total weight for the user
-        SET total_score = 0;
-        SET total_weight = 0;
-
-        -- Calculate the total weighted score for the user
-        SELECT SUM(corrections.score * projects.weight)
-        INTO total_score
-        FROM corrections
-        JOIN projects ON corrections.project_id = projects.id
-        WHERE corrections.user_id = user_id;
-
-        -- Calculate the total weight of all projects
-        SELECT SUM(weight)
-        INTO total_weight
-        FROM projects;
-
-        -- Calculate the average weighted score for the user
-        IF total_weight > 0 THEN
-            SET avg_score = total_score / total_weight;
-        ELSE
-            SET avg_score = 0;
-        END IF;
-
-        -- Update the average score for the user
+    DECLARE batch_start INT;
+    DECLARE max_id INT;
+
+    -- A batch must advance, or the loop below would never end
+    IF batch_size IS NULL OR batch_size < 1 THEN
+        SIGNAL SQLSTATE '45000'
+            SET MESSAGE_TEXT = 'batch_size must be a positive integer';
+    END IF;
+
+    -- The total weight of all projects is the same for every user
+    SELECT SUM(weight)
+    INTO total_weight
+    FROM projects;
+
+    SELECT MIN(id), MAX(id)
+    INTO batch_start, max_id
+    FROM users;
+
+    WHILE batch_start <= max_id DO
+        -- Weighted score of every user of the range, from corrections(user_id, project_id)
         UPDATE users
-        SET average_score = avg_score
-        WHERE id = user_id;
-    END LOOP;
+        LEFT JOIN (
+            SELECT corrections.user_id, SUM(corrections.score * projects.weight) AS total_score
+            FROM corrections
+            JOIN projects ON corrections.project_id = projects.id
+            WHERE corrections.user_id >= batch_start
+            AND corrections.user_id < batch_start + batch_size
+            GROUP BY corrections.user_id
+        ) AS user_scores ON user_scores.user_id = users.id
+        SET users.average_score = IF(total_weight > 0, user_scores.total_score / total_weight, 0)
+        WHERE users.id >= batch_start
+        AND users.id < batch_start + batch_size;
+
+        SET batch_start = batch_start + batch_size;
+    END WHILE;
+END //
 
-    -- Close the cursor
-    CLOSE cur;
+-- Create the procedure
+CREATE PROCEDURE ComputeAverageWeightedScoreForUsers()
+BEGIN
+    CALL ComputeAverageWeightedScoreForUsersInBatches(10000);
 END //
 
 -- Reset the delimiter
-DELIMITER ;
\ No newline at end of file
+DELIMITER ;
@@ -0,0 +1,136 @@
+-- Benchmark ComputeAverageWeightedScoreForUsers against the former cursor loop on 100000 seeded users
+-- Run on a scratch database of a local MySQL 8, after 101-average_weighted_score.sql:
+--   mysql -uroot -p bench < 101-average_weighted_score.sql
+--   mysql -uroot -p bench < 101-benchmark.sql
+
+DROP TABLE IF EXISTS corrections;
+DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS projects;
+DROP TABLE IF EXISTS cursor_scores;
+
+CREATE TABLE IF NOT EXISTS users (
+    id int not null AUTO_INCREMENT,
+    name varchar(255) not null,
+    average_score float default 0,
+    PRIMARY KEY (id)
+);
+
+CREATE TABLE IF NOT EXISTS projects (
+    id int not null AUTO_INCREMENT,
+    name varchar(255) not null,
+    weight int default 1,
+    PRIMARY KEY (id)
+);
+
+CREATE TABLE IF NOT EXISTS corrections (
+    user_id int not null,
+    project_id int not null,
+    score float default 0,
+    KEY `user_id` (`user_id`),
+    KEY `project_id` (`project_id`),
+    CONSTRAINT fk_user_id FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE,
+    CONSTRAINT fk_project_id FOREIGN KEY (`project_id`) REFERENCES `projects` (`id`) ON DELETE CASCADE
+);
+
+-- Seed 100000 users, 10 projects and 500000 corrections
+SET SESSION cte_max_recursion_depth = 100000;
+
+INSERT INTO users (name)
+WITH RECURSIVE seq (n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < 100000)
+SELECT CONCAT('user', n) FROM seq;
+
+INSERT INTO projects (name, weight)
+WITH RECURSIVE seq (n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < 10)
+SELECT CONCAT('project', n), 1 + n % 5 FROM seq;
+
+INSERT INTO corrections (user_id, project_id, score)
+SELECT users.id, projects.id, FLOOR(RAND(users.id * 10 + projects.id) * 101)
+FROM users CROSS JOIN projects
+WHERE (users.id + projects.id) % 2 = 0;
+
+-- The former cursor loop, for comparison
+DROP PROCEDURE IF EXISTS ComputeAverageWeightedScoreForUsersCursor;
+
+DELIMITER //
+
+CREATE PROCEDURE ComputeAverageWeightedScoreForUsersCursor()
+BEGIN
+    DECLARE done INT DEFAULT FALSE;
+    DECLARE user_id INT;
+    DECLARE total_score FLOAT;
+    DECLARE total_weight INT;
+    DECLARE avg_score FLOAT;
+
+    DECLARE cur CURSOR FOR SELECT id FROM users;
+    DECLARE CONTINUE HANDLER FOR NOT FOUND SET done = TRUE;
+
+    OPEN cur;
+
+    user_loop: LOOP
+        FETCH cur INTO user_id;
+        IF done THEN
+            LEAVE user_loop;
+        END IF;
+
+        SET total_score = 0;
+        SET total_weight = 0;
+
+        SELECT SUM(corrections.score * projects.weight)
+        INTO total_score
+        FROM corrections
+        JOIN projects ON corrections.project_id = projects.id
+        WHERE corrections.user_id = user_id;
+
+        SELECT SUM(weight)
+        INTO total_weight
+        FROM projects;
+
+        IF total_weight > 0 THEN
+            SET avg_score = total_score / total_weight;
+        ELSE
+            SET avg_score = 0;
+        END IF;
+
+        UPDATE users
+        SET average_score = avg_score
+        WHERE id = user_id;
+    END LOOP;
+
+    CLOSE cur;
+END //
+
+DELIMITER ;
+
+-- Cursor loop
+SET @start = NOW(6);
+CALL ComputeAverageWeightedScoreForUsersCursor();
+SELECT 'cursor loop' AS version, TIMESTAMPDIFF(MICROSECOND, @start, NOW(6)) / 1000000 AS seconds;
+
+CREATE TABLE cursor_scores AS SELECT id, average_score FROM users;
+UPDATE users SET average_score = 0;
+
+-- Set-based batches, with the foreign key indexes only
+SET @start = NOW(6);
+CALL ComputeAverageWeightedScoreForUsers();
+SELECT 'set-based' AS version, TIMESTAMPDIFF(MICROSECOND, @start, NOW(6)) / 1000000 AS seconds;
+
+UPDATE users SET average_score = 0;
+
+-- Set-based batches, with the corrections(user_id, project_id) index
+CREATE INDEX idx_corrections_user_project
+ON corrections(user_id, project_id);
+
+SET @start = NOW(6);
+CALL ComputeAverageWeightedScoreForUsers();
+SELECT 'set-based, indexed' AS version, TIMESTAMPDIFF(MICROSECOND, @start, NOW(6)) / 1000000 AS seconds;
+
+-- Both versions must agree
+SELECT COUNT(*) AS mismatches
+FROM users
+JOIN cursor_scores ON cursor_scores.id = users.id
+WHERE NOT (users.average_score <=> cursor_scores.average_score)
+AND (users.average_score IS NULL OR cursor_scores.average_score IS NULL
+OR ABS(users.average_score - cursor_scores.average_score) > 0.001);
+
+DROP PROCEDURE IF EXISTS ComputeAverageWeightedScoreForUsersCursor;
+DROP TABLE IF EXISTS cursor_scores;
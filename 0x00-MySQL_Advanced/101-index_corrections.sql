@@ -0,0 +1,4 @@
+-- Create an index idx_corrections_user_project on the user_id and project_id columns in the corrections table
+
+CREATE INDEX idx_corrections_user_project
+ON corrections(user_id, project_id);
@@ -0,0 +1,182 @@
+-- Keep users.running_average_score current with running score totals maintained by triggers on corrections
+
+-- Running totals of the corrections of each user: score_sum / score_count is AVG(score),
+-- kept in running_average_score, and weighted_score_sum is SUM(score * weight) at the
+-- current project weights. average_score is left to the procedures of 7- and 100-/101-,
+-- which write either the plain or the weighted average there.
+-- The weighted sums read projects.weight, which the schema of 6-/7- lacks: it is added
+-- there with a default of 1, every project then weighing the same
+DROP PROCEDURE IF EXISTS AddColumnIfMissing;
+
+DELIMITER //
+
+-- ALTER TABLE ... ADD COLUMN fails on an existing column, so check information_schema
+-- first and keep this file safe to run again
+CREATE PROCEDURE AddColumnIfMissing(IN target_table VARCHAR(64), IN new_column VARCHAR(64), IN column_definition VARCHAR(255))
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1
+        FROM information_schema.COLUMNS
+        WHERE COLUMNS.TABLE_SCHEMA = DATABASE()
+        AND COLUMNS.TABLE_NAME = target_table
+        AND COLUMNS.COLUMN_NAME = new_column
+    ) THEN
+        SET @add_column = CONCAT('ALTER TABLE `', target_table, '` ADD COLUMN `', new_column, '` ', column_definition);
+        PREPARE add_column FROM @add_column;
+        EXECUTE add_column;
+        DEALLOCATE PREPARE add_column;
+    END IF;
+END //
+
+DELIMITER ;
+
+CALL AddColumnIfMissing('users', 'score_sum', 'DOUBLE NOT NULL DEFAULT 0');
+CALL AddColumnIfMissing('users', 'score_count', 'INT NOT NULL DEFAULT 0');
+CALL AddColumnIfMissing('users', 'weighted_score_sum', 'DOUBLE NOT NULL DEFAULT 0');
+CALL AddColumnIfMissing('users', 'running_average_score', 'FLOAT DEFAULT NULL');
+CALL AddColumnIfMissing('projects', 'weight', 'INT DEFAULT 1');
+DROP PROCEDURE AddColumnIfMissing;
+
+DROP TRIGGER IF EXISTS corrections_after_insert;
+DROP TRIGGER IF EXISTS corrections_after_update;
+DROP TRIGGER IF EXISTS corrections_after_delete;
+DROP TRIGGER IF EXISTS projects_after_update;
+DROP TRIGGER IF EXISTS projects_before_delete;
+DROP PROCEDURE IF EXISTS ApplyCorrectionToUser;
+DROP PROCEDURE IF EXISTS RebuildUserScores;
+DROP PROCEDURE IF EXISTS ReconcileUserScores;
+
+DELIMITER //
+
+-- Add (direction = 1) or remove (direction = -1) one correction from the running totals of its user, in O(1)
+CREATE PROCEDURE ApplyCorrectionToUser(IN user_id INT, IN project_id INT, IN score FLOAT, IN direction INT)
+BEGIN
+    DECLARE weight INT;
+
+    SELECT projects.weight INTO weight FROM projects WHERE projects.id = project_id;
+
+    -- Assignments apply left to right, so running_average_score sees the new totals;
+    -- NULL scores are skipped, as AVG and SUM do
+    UPDATE users
+    SET
+    score_sum = score_sum + direction * COALESCE(score, 0),
+    score_count = score_count + direction * (score IS NOT NULL),
+    weighted_score_sum = weighted_score_sum + direction * COALESCE(score * weight, 0),
+    running_average_score = score_sum / NULLIF(score_count, 0)
+    WHERE users.id = user_id;
+END //
+
+CREATE TRIGGER corrections_after_insert AFTER INSERT ON corrections
+FOR EACH ROW
+BEGIN
+    CALL ApplyCorrectionToUser(NEW.user_id, NEW.project_id, NEW.score, 1);
+END //
+
+CREATE TRIGGER corrections_after_update AFTER UPDATE ON corrections
+FOR EACH ROW
+BEGIN
+    CALL ApplyCorrectionToUser(OLD.user_id, OLD.project_id, OLD.score, -1);
+    CALL ApplyCorrectionToUser(NEW.user_id, NEW.project_id, NEW.score, 1);
+END //
+
+CREATE TRIGGER corrections_after_delete AFTER DELETE ON corrections
+FOR EACH ROW
+BEGIN
+    CALL ApplyCorrectionToUser(OLD.user_id, OLD.project_id, OLD.score, -1);
+END //
+
+-- A new project weight changes the weighted sums of the users it has corrections of
+CREATE TRIGGER projects_after_update AFTER UPDATE ON projects
+FOR EACH ROW
+BEGIN
+    IF NOT (NEW.weight <=> OLD.weight) THEN
+        UPDATE users
+        JOIN (
+            SELECT corrections.user_id, SUM(corrections.score) AS project_score
+            FROM corrections
+            WHERE corrections.project_id = NEW.id
+            GROUP BY corrections.user_id
+        ) AS project_scores ON project_scores.user_id = users.id
+        SET users.weighted_score_sum = users.weighted_score_sum
+            + COALESCE(project_scores.project_score * (COALESCE(NEW.weight, 0) - COALESCE(OLD.weight, 0)), 0);
+    END IF;
+END //
+
+-- Corrections deleted by ON DELETE CASCADE do not fire their triggers, so remove them here
+CREATE TRIGGER projects_before_delete BEFORE DELETE ON projects
+FOR EACH ROW
+BEGIN
+    UPDATE users
+    JOIN (
+        SELECT corrections.user_id, SUM(corrections.score) AS project_score, COUNT(corrections.score) AS project_count
+        FROM corrections
+        WHERE corrections.project_id = OLD.id
+        GROUP BY corrections.user_id
+    ) AS project_scores ON project_scores.user_id = users.id
+    SET
+    users.score_sum = users.score_sum - COALESCE(project_scores.project_score, 0),
+    users.score_count = users.score_count - project_scores.project_count,
+    users.weighted_score_sum = users.weighted_score_sum - COALESCE(project_scores.project_score * OLD.weight, 0);
+
+    -- Multiple-table assignments have no set order, so the averages come after the totals
+    UPDATE users
+    SET running_average_score = score_sum / NULLIF(score_count, 0)
+    WHERE id IN (SELECT corrections.user_id FROM corrections WHERE corrections.project_id = OLD.id);
+END //
+
+-- Recompute the running totals and running_average_score of every user from corrections
+CREATE PROCEDURE RebuildUserScores()
+BEGIN
+    UPDATE users
+    LEFT JOIN (
+        SELECT corrections.user_id,
+        SUM(corrections.score) AS score_sum,
+        COUNT(corrections.score) AS score_count,
+        SUM(corrections.score * projects.weight) AS weighted_score_sum
+        FROM corrections
+        JOIN projects ON corrections.project_id = projects.id
+        GROUP BY corrections.user_id
+    ) AS totals ON totals.user_id = users.id
+    SET
+    users.score_sum = COALESCE(totals.score_sum, 0),
+    users.score_count = COALESCE(totals.score_count, 0),
+    users.weighted_score_sum = COALESCE(totals.weighted_score_sum, 0),
+    users.running_average_score = totals.score_sum / NULLIF(totals.score_count, 0);
+END //
+
+-- List the users whose running totals or running_average_score differ from a full recompute,
+-- and rebuild them all if fix is true
+CREATE PROCEDURE ReconcileUserScores(IN fix BOOLEAN)
+BEGIN
+    SELECT users.id, users.score_sum, users.score_count, users.weighted_score_sum,
+    users.running_average_score,
+    COALESCE(totals.score_sum, 0) AS expected_score_sum,
+    COALESCE(totals.score_count, 0) AS expected_score_count,
+    COALESCE(totals.weighted_score_sum, 0) AS expected_weighted_score_sum,
+    totals.score_sum / NULLIF(totals.score_count, 0) AS expected_running_average_score
+    FROM users
+    LEFT JOIN (
+        SELECT corrections.user_id,
+        SUM(corrections.score) AS score_sum,
+        COUNT(corrections.score) AS score_count,
+        SUM(corrections.score * projects.weight) AS weighted_score_sum
+        FROM corrections
+        JOIN projects ON corrections.project_id = projects.id
+        GROUP BY corrections.user_id
+    ) AS totals ON totals.user_id = users.id
+    WHERE users.score_count <> COALESCE(totals.score_count, 0)
+    OR ABS(users.score_sum - COALESCE(totals.score_sum, 0)) > 0.0001
+    OR ABS(users.weighted_score_sum - COALESCE(totals.weighted_score_sum, 0)) > 0.0001
+    OR (NOT (users.running_average_score <=> totals.score_sum / NULLIF(totals.score_count, 0))
+        AND (users.running_average_score IS NULL OR totals.score_count IS NULL OR totals.score_count = 0
+        OR ABS(users.running_average_score - totals.score_sum / totals.score_count) > 0.001));
+
+    IF fix THEN
+        CALL RebuildUserScores();
+    END IF;
+END //
+
+DELIMITER ;
+
+-- Start from the current corrections
+CALL RebuildUserScores();
@@ -0,0 +1,50 @@
+-- Create a stored procedure AddBonuses that adds the corrections staged in bonus_staging, creating their missing projects
+
+-- Staged bonuses, one row per AddBonus(user_id, project_name, score) call.
+-- Sessions running AddBonuses concurrently each create a TEMPORARY bonus_staging
+-- with the same columns, which hides this table for them
+CREATE TABLE IF NOT EXISTS bonus_staging (
+    user_id INT NOT NULL,
+    project_name VARCHAR(255) NOT NULL,
+    score INT
+);
+
+DROP PROCEDURE IF EXISTS AddBonuses;
+
+DELIMITER //
+
+CREATE PROCEDURE AddBonuses()
+BEGIN
+    -- A failed row, such as an unknown user_id, cancels the whole batch
+    -- instead of leaving the session inside an open transaction
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        RESIGNAL;
+    END;
+
+    -- Create the missing projects, in one statement; the unique index on
+    -- projects.name skips those a concurrent session just created
+    INSERT INTO projects (name)
+    SELECT missing.project_name FROM (
+        SELECT DISTINCT bonus_staging.project_name
+        FROM bonus_staging
+        LEFT JOIN projects AS existing ON existing.name = bonus_staging.project_name
+        WHERE existing.id IS NULL
+    ) AS missing
+    ON DUPLICATE KEY UPDATE projects.id = projects.id;
+
+    -- Add every correction and empty the staging table together
+    START TRANSACTION;
+
+    INSERT INTO corrections (user_id, project_id, score)
+    SELECT bonus_staging.user_id, projects.id, bonus_staging.score
+    FROM bonus_staging
+    JOIN projects ON projects.name = bonus_staging.project_name;
+
+    DELETE FROM bonus_staging;
+
+    COMMIT;
+END //
+
+DELIMITER ;
@@ -0,0 +1,60 @@
+#!/usr/bin/env bash
+# Benchmark AddBonus, before and after the unique project name index, and AddBonuses under concurrent sessions
+#
+# Usage: ./103-bonus_benchmark.sh [database] [concurrency]
+#
+# Needs mysql and mysqlslap from a local MySQL 8 and a scratch database,
+# bench by default, whose tables are dropped. Client options such as
+# -uroot -p go in MYSQL_OPTIONS. Each run adds about BONUSES corrections
+# over 500 new projects, split across the sessions, then prints the
+# mysqlslap timings, the corrections added and the projects created twice.
+# The legacy run stops at its first duplicate project, whose lookup then
+# fails with "Result consisted of more than one row"; its error is
+# printed and the other runs go on.
+set -e
+cd "$(dirname "$0")"
+
+DATABASE=${1:-bench}
+CONCURRENCY=${2:-8}
+BONUSES=${BONUSES:-20000}
+BATCH=1000
+MYSQL="mysql $MYSQL_OPTIONS $DATABASE"
+
+BONUS_ARGS="1 + FLOOR(RAND() * 1000), CONCAT('project', FLOOR(RAND() * 500)), FLOOR(RAND() * 101)"
+
+setup() {
+    $MYSQL < 103-bonus_benchmark.sql
+    $MYSQL < 6-bonus.sql
+    $MYSQL < 103-add_bonuses.sql
+}
+
+# --number-of-queries is per session, so $3 is the total to split
+slap() {
+    echo "== $1"
+    # shellcheck disable=SC2086
+    mysqlslap $MYSQL_OPTIONS --create-schema="$DATABASE" --no-drop \
+        --concurrency="$CONCURRENCY" \
+        --number-of-queries="$(( ($3 + CONCURRENCY - 1) / CONCURRENCY ))" \
+        --delimiter=";" --query="$2" 2>&1 | grep -iE "seconds|error" || true
+    $MYSQL -e "SELECT COUNT(*) AS corrections,
+               (SELECT COUNT(*) - COUNT(DISTINCT name) FROM projects) AS duplicate_projects
+               FROM corrections"
+}
+
+setup
+slap "AddBonusLegacy, no index on projects.name" \
+    "CALL AddBonusLegacy($BONUS_ARGS)" "$BONUSES"
+
+setup
+$MYSQL < 103-unique_project_name.sql
+slap "AddBonus, unique index on projects.name" \
+    "CALL AddBonus($BONUS_ARGS)" "$BONUSES"
+
+setup
+$MYSQL < 103-unique_project_name.sql
+# Three statements per batch of BATCH bonuses, whole batches per session
+BATCHES=$(( (BONUSES + BATCH * CONCURRENCY - 1) / (BATCH * CONCURRENCY) ))
+slap "AddBonuses, batches of $BATCH" \
+    "CREATE TEMPORARY TABLE IF NOT EXISTS bonus_staging (user_id INT NOT NULL, project_name VARCHAR(255) NOT NULL, score INT);
+INSERT INTO bonus_staging SELECT $BONUS_ARGS FROM bench_seq LIMIT $BATCH;
+CALL AddBonuses()" "$((3 * BATCHES * CONCURRENCY))"
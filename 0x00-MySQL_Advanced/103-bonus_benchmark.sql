@@ -0,0 +1,66 @@
+-- Schema of the AddBonus benchmark: 1000 users, no project yet, and the former AddBonus as AddBonusLegacy
+-- Loaded by 103-bonus_benchmark.sh before each run
+
+DROP TABLE IF EXISTS corrections;
+DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS projects;
+DROP TABLE IF EXISTS bonus_staging;
+DROP TABLE IF EXISTS bench_seq;
+
+CREATE TABLE IF NOT EXISTS users (
+    id int not null AUTO_INCREMENT,
+    name varchar(255) not null,
+    average_score float default 0,
+    PRIMARY KEY (id)
+);
+
+CREATE TABLE IF NOT EXISTS projects (
+    id int not null AUTO_INCREMENT,
+    name varchar(255) not null,
+    PRIMARY KEY (id)
+);
+
+CREATE TABLE IF NOT EXISTS corrections (
+    user_id int not null,
+    project_id int not null,
+    score int default 0,
+    KEY `user_id` (`user_id`),
+    KEY `project_id` (`project_id`),
+    CONSTRAINT fk_user_id FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE,
+    CONSTRAINT fk_project_id FOREIGN KEY (`project_id`) REFERENCES `projects` (`id`) ON DELETE CASCADE
+);
+
+-- 1000 rows to generate the staged batches from
+CREATE TABLE bench_seq (n INT NOT NULL PRIMARY KEY);
+
+INSERT INTO bench_seq (n)
+WITH RECURSIVE seq (n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < 1000)
+SELECT n FROM seq;
+
+INSERT INTO users (name)
+SELECT CONCAT('user', n) FROM bench_seq;
+
+-- The former AddBonus, for comparison
+DROP PROCEDURE IF EXISTS AddBonusLegacy;
+
+DELIMITER //
+
+CREATE PROCEDURE AddBonusLegacy(
+    IN user_id INT,
+    IN project_name VARCHAR(255),
+    IN score INT
+)
+BEGIN
+    DECLARE project_id INT;
+
+    SELECT id INTO project_id FROM projects WHERE name = project_name;
+
+    IF project_id IS NULL THEN
+        INSERT INTO projects (name) VALUES (project_name);
+        SET project_id = LAST_INSERT_ID();
+    END IF;
+
+    INSERT INTO corrections (user_id, project_id, score) VALUES (user_id, project_id, score);
+END //
+
+DELIMITER ;
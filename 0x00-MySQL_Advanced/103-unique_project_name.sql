@@ -0,0 +1,19 @@
+-- Create a unique index idx_projects_name on the name column in the projects table
+
+-- Merge the projects already sharing a name into the first of them
+UPDATE corrections
+JOIN projects ON projects.id = corrections.project_id
+JOIN (
+    SELECT name, MIN(id) AS id FROM projects GROUP BY name HAVING COUNT(*) > 1
+) AS firsts ON firsts.name = projects.name
+SET corrections.project_id = firsts.id
+WHERE projects.id <> firsts.id;
+
+DELETE projects FROM projects
+JOIN (
+    SELECT name, MIN(id) AS id FROM projects GROUP BY name HAVING COUNT(*) > 1
+) AS firsts ON firsts.name = projects.name
+WHERE projects.id <> firsts.id;
+
+CREATE UNIQUE INDEX idx_projects_name
+ON projects(name);
@@ -0,0 +1,7 @@
+-- Create an index idx_students_score_meeting on the score, last_meeting and name columns in the students table
+
+-- score < 80 is the selective predicate of need_meeting, so it leads: the view
+-- becomes one range on score, last_meeting is checked in the index and name
+-- makes it covering, so the table rows are never read
+CREATE INDEX idx_students_score_meeting
+ON students(score, last_meeting, name);
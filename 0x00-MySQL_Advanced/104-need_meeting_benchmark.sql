@@ -0,0 +1,61 @@
+-- Benchmark the need_meeting view and a UNION ALL rewrite of it on 1000000 seeded students, before and after its index
+-- Run from this directory on a scratch database of a local MySQL 8:
+--   mysql -uroot -p bench < 104-need_meeting_benchmark.sql
+-- About 5% of the students score under 80 and 2% never had a meeting,
+-- the others had one in the last 60 days
+
+DROP VIEW IF EXISTS need_meeting_union;
+DROP VIEW IF EXISTS need_meeting;
+DROP TABLE IF EXISTS students;
+
+CREATE TABLE IF NOT EXISTS students (
+    name VARCHAR(255) NOT NULL,
+    score INT default 0,
+    last_meeting DATE NULL
+);
+
+INSERT INTO students (name, score, last_meeting)
+WITH RECURSIVE seq (n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < 999)
+SELECT CONCAT('student', a.n * 1000 + b.n),
+IF(RAND(a.n * 1000 + b.n) < 0.05, FLOOR(RAND() * 80), 80 + FLOOR(RAND() * 21)),
+IF(RAND() < 0.02, NULL, CURDATE() - INTERVAL FLOOR(RAND() * 60) DAY)
+FROM seq AS a CROSS JOIN seq AS b;
+
+ANALYZE TABLE students;
+
+SOURCE 11-need_meeting.sql;
+
+-- One branch per case of last_meeting, for comparison
+CREATE VIEW need_meeting_union AS
+SELECT name FROM students WHERE students.last_meeting IS NULL AND score < 80
+UNION ALL
+SELECT name FROM students WHERE students.last_meeting < DATE_ADD(NOW(), INTERVAL -1 MONTH) AND score < 80;
+
+-- Without the index
+EXPLAIN SELECT name FROM need_meeting;
+EXPLAIN SELECT name FROM need_meeting_union;
+
+SET @start = NOW(6);
+SELECT COUNT(*) FROM need_meeting;
+SELECT 'view' AS version, TIMESTAMPDIFF(MICROSECOND, @start, NOW(6)) / 1000000 AS seconds;
+
+SET @start = NOW(6);
+SELECT COUNT(*) FROM need_meeting_union;
+SELECT 'union view' AS version, TIMESTAMPDIFF(MICROSECOND, @start, NOW(6)) / 1000000 AS seconds;
+
+-- With the index
+SOURCE 104-index_need_meeting.sql;
+ANALYZE TABLE students;
+
+EXPLAIN SELECT name FROM need_meeting;
+EXPLAIN SELECT name FROM need_meeting_union;
+
+SET @start = NOW(6);
+SELECT COUNT(*) FROM need_meeting;
+SELECT 'view, indexed' AS version, TIMESTAMPDIFF(MICROSECOND, @start, NOW(6)) / 1000000 AS seconds;
+
+SET @start = NOW(6);
+SELECT COUNT(*) FROM need_meeting_union;
+SELECT 'union view, indexed' AS version, TIMESTAMPDIFF(MICROSECOND, @start, NOW(6)) / 1000000 AS seconds;
+
+DROP VIEW IF EXISTS need_meeting_union;
@@ -0,0 +1,5 @@
+-- Rank country origins of bands by the number of fans, from the rollup of 105-metal_bands_rollups.sql
+
+-- Read the fans of each origin in idx_origin_fans_nb_fans order
+SELECT origin, nb_fans FROM origin_fans
+ORDER BY nb_fans DESC;
\ No newline at end of file
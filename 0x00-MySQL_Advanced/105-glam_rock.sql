@@ -0,0 +1,6 @@
+-- List bands with Glam rock as main style, ranked by longevity, from the indexes of 105-metal_bands_rollups.sql
+
+-- Find the bands in band_styles and read their stored lifespan
+SELECT band_name, lifespan FROM band_styles
+JOIN metal_bands ON metal_bands.id = band_styles.band_id
+WHERE band_styles.style = 'Glam rock' ORDER BY lifespan DESC;
\ No newline at end of file
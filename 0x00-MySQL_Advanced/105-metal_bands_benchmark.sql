@@ -0,0 +1,69 @@
+-- Benchmark 2-fans.sql and 3-glam_rock.sql against their 105- versions on metal_bands scaled up 1000 times
+-- Run from this directory on a scratch database of a local MySQL 8.0.18 or later:
+--   mysql -uroot -p bench < metal_bands.sql
+--   mysql -uroot -p bench < 105-metal_bands_benchmark.sql
+-- EXPLAIN ANALYZE runs each query and prints its plan with the time spent,
+-- without printing its rows
+
+DROP TABLE IF EXISTS band_styles;
+DROP TABLE IF EXISTS origin_fans;
+
+-- 999 renamed copies of every band
+INSERT INTO metal_bands (band_name, fans, formed, origin, split, style)
+WITH RECURSIVE seq (n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < 999)
+SELECT CONCAT(metal_bands.band_name, ' ', seq.n), metal_bands.fans, metal_bands.formed,
+metal_bands.origin, metal_bands.split, metal_bands.style
+FROM metal_bands CROSS JOIN seq;
+
+ANALYZE TABLE metal_bands;
+
+-- Former queries
+EXPLAIN ANALYZE
+SELECT origin, SUM(fans) as nb_fans FROM metal_bands
+GROUP BY origin ORDER BY nb_fans DESC;
+
+EXPLAIN ANALYZE
+SELECT band_name, COALESCE(split, 2022) - formed as lifespan FROM metal_bands
+WHERE style LIKE '%Glam rock%' ORDER BY lifespan DESC;
+
+-- Cost of 10000 inserts without the triggers
+SET @start = NOW(6);
+INSERT INTO metal_bands (band_name, fans, formed, origin, split, style)
+SELECT CONCAT(band_name, ' bis'), fans, formed, origin, split, style FROM metal_bands
+ORDER BY id LIMIT 10000;
+SELECT 'insert 10000, no triggers' AS version, TIMESTAMPDIFF(MICROSECOND, @start, NOW(6)) / 1000000 AS seconds;
+
+SET @start = NOW(6);
+SOURCE 105-metal_bands_rollups.sql;
+SELECT 'build rollups' AS version, TIMESTAMPDIFF(MICROSECOND, @start, NOW(6)) / 1000000 AS seconds;
+
+ANALYZE TABLE metal_bands, band_styles, origin_fans;
+
+-- Indexed queries
+EXPLAIN ANALYZE
+SELECT origin, nb_fans FROM origin_fans
+ORDER BY nb_fans DESC;
+
+EXPLAIN ANALYZE
+SELECT band_name, lifespan FROM band_styles
+JOIN metal_bands ON metal_bands.id = band_styles.band_id
+WHERE band_styles.style = 'Glam rock' ORDER BY lifespan DESC;
+
+-- Cost of 10000 inserts with the triggers
+SET @start = NOW(6);
+INSERT INTO metal_bands (band_name, fans, formed, origin, split, style)
+SELECT CONCAT(band_name, ' ter'), fans, formed, origin, split, style FROM metal_bands
+ORDER BY id LIMIT 10000;
+SELECT 'insert 10000, triggers' AS version, TIMESTAMPDIFF(MICROSECOND, @start, NOW(6)) / 1000000 AS seconds;
+
+-- Both versions must agree
+SELECT COUNT(*) AS fans_mismatches
+FROM (
+    SELECT origin, SUM(fans) AS nb_fans FROM metal_bands GROUP BY origin
+) AS legacy
+LEFT JOIN origin_fans ON origin_fans.origin <=> legacy.origin
+WHERE NOT (origin_fans.nb_fans <=> legacy.nb_fans);
+
+SELECT
+(SELECT COUNT(*) FROM metal_bands WHERE style LIKE '%Glam rock%') AS glam_rock_legacy,
+(SELECT COUNT(*) FROM band_styles WHERE style = 'Glam rock') AS glam_rock_indexed;
@@ -0,0 +1,122 @@
+-- Index the styles, lifespan and fans per origin of metal_bands, kept up to date by triggers
+
+-- Lifespan as computed by 3-glam_rock.sql, stored so it can be indexed
+ALTER TABLE metal_bands
+    ADD COLUMN lifespan INT AS (COALESCE(split, 2022) - formed) STORED,
+    ADD INDEX idx_metal_bands_lifespan (lifespan);
+
+-- One row per style of each band, from its comma-separated style column
+DROP TABLE IF EXISTS band_styles;
+CREATE TABLE band_styles (
+    band_id INT NOT NULL,
+    style VARCHAR(255) NOT NULL,
+    PRIMARY KEY (band_id, style),
+    KEY idx_band_styles_style (style, band_id)
+);
+
+-- SUM(fans) and COUNT(*) of the bands of each origin; origin may be NULL,
+-- like in metal_bands, so the rows are keyed on origin_key instead
+DROP TABLE IF EXISTS origin_fans;
+CREATE TABLE origin_fans (
+    origin VARCHAR(255) DEFAULT NULL,
+    origin_key VARCHAR(256) AS (IF(origin IS NULL, '', CONCAT('=', origin))) STORED NOT NULL,
+    nb_fans BIGINT NOT NULL DEFAULT 0,
+    nb_bands INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (origin_key),
+    KEY idx_origin_fans_nb_fans (nb_fans, origin)
+);
+
+DROP TRIGGER IF EXISTS metal_bands_after_insert;
+DROP TRIGGER IF EXISTS metal_bands_after_update;
+DROP TRIGGER IF EXISTS metal_bands_after_delete;
+DROP PROCEDURE IF EXISTS AddBandStyles;
+DROP PROCEDURE IF EXISTS AddOriginFans;
+DROP PROCEDURE IF EXISTS RebuildBandRollups;
+
+DELIMITER //
+
+-- Add one band_styles row per style of a comma-separated list
+CREATE PROCEDURE AddBandStyles(IN band_id INT, IN style VARCHAR(255))
+BEGIN
+    DECLARE rest VARCHAR(255) DEFAULT style;
+    DECLARE part VARCHAR(255);
+
+    WHILE rest IS NOT NULL DO
+        SET part = TRIM(SUBSTRING_INDEX(rest, ',', 1));
+        IF part <> '' THEN
+            INSERT INTO band_styles (band_id, style) VALUES (band_id, part)
+            ON DUPLICATE KEY UPDATE band_styles.band_id = band_styles.band_id;
+        END IF;
+        SET rest = IF(LOCATE(',', rest) > 0, SUBSTRING(rest, LOCATE(',', rest) + 1), NULL);
+    END WHILE;
+END //
+
+-- Add fans and bands, possibly negative, to the row of origin, dropping it once it has no band
+CREATE PROCEDURE AddOriginFans(IN origin VARCHAR(255), IN fans BIGINT, IN bands INT)
+BEGIN
+    INSERT INTO origin_fans (origin, nb_fans, nb_bands) VALUES (origin, fans, bands)
+    ON DUPLICATE KEY UPDATE
+    origin_fans.nb_fans = origin_fans.nb_fans + fans,
+    origin_fans.nb_bands = origin_fans.nb_bands + bands;
+
+    IF bands < 0 THEN
+        DELETE FROM origin_fans
+        WHERE origin_key = IF(origin IS NULL, '', CONCAT('=', origin)) AND nb_bands <= 0;
+    END IF;
+END //
+
+CREATE TRIGGER metal_bands_after_insert AFTER INSERT ON metal_bands
+FOR EACH ROW
+BEGIN
+    CALL AddBandStyles(NEW.id, NEW.style);
+    CALL AddOriginFans(NEW.origin, COALESCE(NEW.fans, 0), 1);
+END //
+
+CREATE TRIGGER metal_bands_after_update AFTER UPDATE ON metal_bands
+FOR EACH ROW
+BEGIN
+    IF NEW.id <> OLD.id OR NOT (NEW.style <=> OLD.style) THEN
+        DELETE FROM band_styles WHERE band_styles.band_id = OLD.id;
+        CALL AddBandStyles(NEW.id, NEW.style);
+    END IF;
+    IF NOT (NEW.origin <=> OLD.origin) OR NOT (NEW.fans <=> OLD.fans) THEN
+        CALL AddOriginFans(OLD.origin, -COALESCE(OLD.fans, 0), -1);
+        CALL AddOriginFans(NEW.origin, COALESCE(NEW.fans, 0), 1);
+    END IF;
+END //
+
+CREATE TRIGGER metal_bands_after_delete AFTER DELETE ON metal_bands
+FOR EACH ROW
+BEGIN
+    DELETE FROM band_styles WHERE band_styles.band_id = OLD.id;
+    CALL AddOriginFans(OLD.origin, -COALESCE(OLD.fans, 0), -1);
+END //
+
+-- Recompute band_styles and origin_fans from metal_bands, set-based
+CREATE PROCEDURE RebuildBandRollups()
+BEGIN
+    DELETE FROM band_styles;
+
+    -- A VARCHAR(255) holds at most 128 comma-separated styles
+    INSERT INTO band_styles (band_id, style)
+    SELECT DISTINCT parts.band_id, parts.style FROM (
+        WITH RECURSIVE seq (n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < 128)
+        SELECT metal_bands.id AS band_id,
+        TRIM(SUBSTRING_INDEX(SUBSTRING_INDEX(metal_bands.style, ',', seq.n), ',', -1)) AS style
+        FROM metal_bands
+        JOIN seq ON seq.n <= 1 + LENGTH(metal_bands.style) - LENGTH(REPLACE(metal_bands.style, ',', ''))
+    ) AS parts
+    WHERE parts.style <> '';
+
+    DELETE FROM origin_fans;
+
+    INSERT INTO origin_fans (origin, nb_fans, nb_bands)
+    SELECT origin, COALESCE(SUM(fans), 0), COUNT(*) FROM metal_bands
+    GROUP BY origin;
+END //
+
+DELIMITER ;
+
+-- Start from the current bands; reloading metal_bands.sql drops the table
+-- with its triggers, so run this file again afterwards
+CALL RebuildBandRollups();
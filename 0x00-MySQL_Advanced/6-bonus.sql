@@ -14,12 +14,15 @@ CREATE PROCEDURE AddBonus(
 BEGIN
     DECLARE project_id INT;
 
-    -- Check if the project already exists
+    -- Check if the project already exists, with the idx_projects_name index
     SELECT id INTO project_id FROM projects WHERE name = project_name;
-    
-    -- If the project doesn't exist, create it
+
+    -- If the project doesn't exist, create it; a concurrent caller may have
+    -- just created it, in which case the unique index turns the insert into
+    -- a lookup of its id
     IF project_id IS NULL THEN
-        INSERT INTO projects (name) VALUES (project_name);
+        INSERT INTO projects (name) VALUES (project_name)
+        ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id);
         SET project_id = LAST_INSERT_ID();
     END IF;
 
@@ -2,6 +2,12 @@
 """
 Module containing function to update topics of a school document
 """
+from pymongo import UpdateMany
+from pymongo.errors import PyMongoError
+insert_school_module = __import__('9-insert_school')
+CHUNK_SIZE = insert_school_module.CHUNK_SIZE
+chunks = insert_school_module.chunks
+chunk_failure = insert_school_module.chunk_failure
 
 
 def update_topics(mongo_collection, name, topics):
@@ -16,4 +22,45 @@ def update_topics(mongo_collection, name, topics):
     Returns:
         None
     """
-    mongo_collection.update_many({"name": name}, {"$set": {"topics": topics}})
\ No newline at end of file
+    mongo_collection.update_many({"name": name}, {"$set": {"topics": topics}})
+
+
+def bulk_update_topics(mongo_collection, topics_by_name,
+                       chunk_size=CHUNK_SIZE, write_concern=None):
+    """
+    Changes all topics of many school documents, chunk_size names per
+    round trip
+
+    Chunks are unordered bulk writes: an update that fails does not stop
+    the others, nor do the failures of a chunk stop the next chunks.
+
+    Args:
+        mongo_collection: PyMongo collection object
+        topics_by_name (dict): The list of topics of each school name
+        chunk_size (int): Names per bulk_write
+        write_concern: Optional pymongo WriteConcern of the updates
+
+    Returns:
+        tuple: The number of documents modified, 0 with an unacknowledged
+        write concern, and the list of the failures of the chunks, as
+        described by chunk_failure in 9-insert_school
+    """
+    if write_concern is not None:
+        mongo_collection = mongo_collection.with_options(
+            write_concern=write_concern)
+    operations = (UpdateMany({"name": name}, {"$set": {"topics": topics}})
+                  for name, topics in topics_by_name.items())
+    modified_count = 0
+    failures = []
+    for index, chunk in enumerate(chunks(operations, chunk_size)):
+        try:
+            result = mongo_collection.bulk_write(chunk, ordered=False)
+        except PyMongoError as error:
+            details = getattr(error, 'details', None) or {}
+            modified_count += details.get('nModified', 0)
+            failures.append(chunk_failure(index, error))
+            continue
+        # Unacknowledged writes (w=0) report no count
+        if result.acknowledged:
+            modified_count += result.modified_count
+    return modified_count, failures
@@ -2,34 +2,83 @@
 """
 Top students
 """
-from pymongo import MongoClient
+import heapq
 
 
 def get_average_score(student):
-    """Calculate and return the average score of a student."""
-    total_score = sum(topic['score'] for topic in student['topics'])
-    average_score = total_score / len(student['topics'])
+    """
+    Calculate the average score of a student, store it as averageScore and
+    return it; None when the student has no topic, as $avg does.
+    """
+    scores = [topic['score'] for topic in student.get('topics') or []]
+    average_score = sum(scores) / len(scores) if scores else None
     student['averageScore'] = average_score
     return average_score
 
 
-def top_students(mongo_collection):
+def top_students_pipeline(limit=0, projection=None):
+    """
+    Builds the aggregation pipeline of top_students
+
+    Args:
+        limit (int): Number of students to return, 0 for all
+        projection (dict): Optional inclusion projection; averageScore is
+            always kept
+
+    Returns:
+        list: The pipeline stages
+    """
+    pipeline = [{'$addFields': {'averageScore': {'$avg': '$topics.score'}}}]
+    if projection:
+        pipeline.append({'$project': {**projection, 'averageScore': 1}})
+    pipeline.append({'$sort': {'averageScore': -1, '_id': 1}})
+    if limit:
+        pipeline.append({'$limit': limit})
+    return pipeline
+
+
+def top_students(mongo_collection, limit=0, projection=None):
     """
     Returns all students sorted by average score.
 
+    The averages are computed and sorted by the server; with a limit, the
+    sort only keeps the top students in memory.
+
     Args:
         mongo_collection: pymongo collection object representing the students
         collection.
+        limit (int): Number of students to return, 0 for all.
+        projection (dict): Optional inclusion projection of the fields to
+        return; averageScore is always returned.
 
     Returns:
-        list: A list of student documents sorted by average score in descending
-        order.
+        CommandCursor: A lazy cursor over the student documents, with their
+        averageScore, sorted by average score in descending order.
+    """
+    return mongo_collection.aggregate(top_students_pipeline(limit, projection),
+                                      allowDiskUse=True)
+
+
+def top_students_local(students, k):
     """
-    students = list(mongo_collection.find({}))
+    Returns the k students with the highest average score, computing each
+    average once and keeping only k students in memory.
 
-    for student in students:
-        get_average_score(student)
+    Args:
+        students: Iterable of student documents, such as a find() cursor.
+        k (int): Number of students to return.
+
+    Returns:
+        list: The k best student documents, with their averageScore, sorted
+        by average score in descending order.
+    """
+    def key(student):
+        score = student['averageScore']
+        return float('-inf') if score is None else score
 
-    sorted_students = sorted(students, key=get_average_score, reverse=True)
+    def scored():
+        for student in students:
+            get_average_score(student)
+            yield student
 
-    return sorted_students
+    return heapq.nlargest(k, scored(), key=key)
@@ -1,50 +1,63 @@
 #!/usr/bin/env python3
 """
 Script to provide stats about Nginx logs stored in MongoDB
+
+Usage: ./102-log_stats.py [--incremental | --approximate]
+
+With --approximate the top IPs are estimated with bounded-memory sketches
+instead of grouping every distinct IP in the aggregation.
 """
+import sys
 
 from pymongo import MongoClient
+log_stats_module = __import__('12-log_stats')
+METHODS = log_stats_module.METHODS
+log_stats = log_stats_module.log_stats
+approximate_log_stats = log_stats_module.approximate_log_stats
+summary_collection = log_stats_module.summary_collection
+summary_stats = log_stats_module.summary_stats
+update_summary = log_stats_module.update_summary
 
 
-def nginx_log_stats():
+def nginx_log_stats(collection=None, methods=METHODS, top_ips=10,
+                    incremental=False, approximate=False, **bounds):
     """
     Function to retrieve stats about Nginx logs
-    """
-    client = MongoClient()
-    db = client.logs
-    collection = db.nginx
-
-    total_logs = collection.count_documents({})
-
-    http_methods = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
-    method_counts = {}
-    for method in http_methods:
-        count = collection.count_documents({'method': method})
-        method_counts[method] = count
-
-    status_check_count = collection.count_documents({
-        'method': 'GET',
-        'path': '/status'
-        })
 
-    # Top 10 IPs
-    pipeline = [
-        {"$group": {"_id": "$ip", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-        {"$limit": 10}
-    ]
-    top_ips = collection.aggregate(pipeline)
-
-    client.close()
-
-    return total_logs, method_counts, status_check_count, top_ips
-
-
-def print_nginx_stats():
+    Args:
+        collection: Logs collection, logs.nginx on localhost by default
+        methods (list): Methods to report, in order
+        top_ips (int): Number of most frequent IPs to return
+        incremental (bool): Read the stats from the summary collection,
+            updated first, rather than scanning every log
+        approximate (bool): Estimate the top IPs with sketches
+        bounds: Error bounds of the sketches, see ip_sketch in 12-log_stats
+    """
+    client = None
+    if collection is None:
+        client = MongoClient()
+        collection = client.logs.nginx
+
+    try:
+        if incremental:
+            update_summary(collection)
+            return summary_stats(summary_collection(collection), methods,
+                                 top_ips)
+        if approximate:
+            return approximate_log_stats(collection, methods, top_ips,
+                                         **bounds)
+        return log_stats(collection, methods, top_ips)
+    finally:
+        if client is not None:
+            client.close()
+
+
+def print_nginx_stats(incremental=False, approximate=False):
     """
     Function to print stats about Nginx logs
     """
-    total_logs, method_counts, status_check_count, top_ips = nginx_log_stats()
+    total_logs, method_counts, status_check_count, top_ips = nginx_log_stats(
+        incremental=incremental, approximate=approximate)
 
     print(f"{total_logs} logs")
 
@@ -62,4 +75,5 @@ def print_nginx_stats():
 
 
 if __name__ == "__main__":
-    print_nginx_stats()
\ No newline at end of file
+    print_nginx_stats(incremental='--incremental' in sys.argv[1:],
+                      approximate='--approximate' in sys.argv[1:])
@@ -2,6 +2,7 @@
 """
 Module containing function to find schools by topic
 """
+iter_documents = __import__('8-all').iter_documents
 
 
 def schools_by_topic(mongo_collection, topic):
@@ -17,4 +18,16 @@ def schools_by_topic(mongo_collection, topic):
     """
     schools = mongo_collection.find({"topics": topic})
     
-    return list(schools)
\ No newline at end of file
+    return list(schools)
+
+
+def iter_schools_by_topic(mongo_collection, topic, **kwargs):
+    """
+    Yields the schools having a specific topic, see iter_documents in
+    8-all for kwargs
+
+    Args:
+        mongo_collection: PyMongo collection object
+        topic (str): The topic to search for
+    """
+    return iter_documents(mongo_collection, {"topics": topic}, **kwargs)
@@ -1,42 +1,469 @@
 #!/usr/bin/env python3
 """
 Script to provide stats about Nginx logs stored in MongoDB
+
+Usage: ./12-log_stats.py [--incremental | --rebuild | --check | --parallel]
+
+With --incremental the stats are read from a summary collection that
+each run brings up to date with the logs inserted since its checkpoint;
+--rebuild recomputes that summary from scratch and --check compares it
+with a full scan. With --parallel the logs are counted client-side by
+one process per core.
 """
+import heapq
+import multiprocessing.util
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
 
-from pymongo import MongoClient
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne
+ItemSketch = __import__('sketches').ItemSketch
 
+METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+OTHER = 'other'
+CHECKPOINT = 'checkpoint'
+LAG = 60
+BATCH_SIZE = 10000
+SCAN_FIELDS = {'_id': 0, 'method': 1, 'path': 1, 'ip': 1}
+SAMPLES_PER_PARTITION = 100
 
-def nginx_log_stats():
+
+def stats_pipeline(top_ips=0, match=None):
     """
-    Function to retrieve stats about Nginx logs
+    Builds the aggregation pipeline computing every stat in one scan
+
+    Args:
+        top_ips (int): Number of most frequent IPs to return, 0 for none
+        match (dict): Optional filter on the logs to scan
+
+    Returns:
+        list: A single $facet stage with total, methods, status_check and,
+        if requested, ips sub-pipelines, after the $match if any
     """
-    client = MongoClient()
-    db = client.logs
-    collection = db.nginx
+    facets = {
+        'total': [{'$count': 'count'}],
+        'methods': [{'$group': {'_id': '$method', 'count': {'$sum': 1}}}],
+        'status_check': [
+            {'$match': {'method': 'GET', 'path': '/status'}},
+            {'$count': 'count'}
+        ],
+    }
+    if top_ips:
+        facets['ips'] = [
+            {'$group': {'_id': '$ip', 'count': {'$sum': 1}}},
+            {'$sort': {'count': -1, '_id': 1}},
+            {'$limit': top_ips}
+        ]
+    pipeline = [{'$match': match}] if match else []
+    return pipeline + [{'$facet': facets}]
 
-    total_logs = collection.count_documents({})
 
-    http_methods = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
-    method_counts = {}
-    for method in http_methods:
-        count = collection.count_documents({'method': method})
-        method_counts[method] = count
+def bucket_methods(buckets, methods=METHODS):
+    """
+    Folds per-method counts into the configured methods
+
+    Args:
+        buckets: Iterable of {'_id': method, 'count': n} documents
+        methods (list): Methods to report, in order
+
+    Returns:
+        dict: Count per method, with methods outside the list summed under
+        OTHER when there are any
+    """
+    method_counts = dict.fromkeys(methods, 0)
+    other = 0
+    for bucket in buckets:
+        if bucket['_id'] in method_counts:
+            method_counts[bucket['_id']] += bucket['count']
+        else:
+            other += bucket['count']
+    if other:
+        method_counts[OTHER] = other
+    return method_counts
+
+
+def log_stats(collection, methods=METHODS, top_ips=0, match=None):
+    """
+    Computes Nginx log stats with a single aggregation over collection
+
+    Args:
+        collection: PyMongo collection object holding the logs
+        methods (list): Methods to report, in order
+        top_ips (int): Number of most frequent IPs to return, 0 for none
+        match (dict): Optional filter on the logs to count
+
+    Returns:
+        tuple: Total logs, count per method, GET /status count and the
+        list of top IPs as {'_id': ip, 'count': n} documents
+    """
+    result = next(collection.aggregate(stats_pipeline(top_ips, match),
+                                       allowDiskUse=True))
+
+    def count(facet):
+        return result[facet][0]['count'] if result[facet] else 0
+
+    return (count('total'), bucket_methods(result['methods'], methods),
+            count('status_check'), result.get('ips', []))
+
+
+def ip_sketch(collection, epsilon=0.001, delta=0.01, rse=0.01,
+              batch_size=BATCH_SIZE, match=None):
+    """
+    Streams the IPs of the logs into an ItemSketch, in memory bounded by
+    the error bounds rather than by the number of distinct IPs
+
+    Sketches of different shards or time windows, selected with match and
+    built with the same bounds, can be merged.
+
+    Args:
+        collection: PyMongo collection object holding the logs
+        epsilon (float): IP counts are overestimated by at most epsilon
+            times the number of logs
+        delta (float): Probability of the Count-Min bound not holding
+        rse (float): Relative standard error of the distinct IP count
+        batch_size (int): Logs fetched per round trip
+        match (dict): Optional filter on the logs to count
+
+    Returns:
+        ItemSketch: The IP sketch
+    """
+    sketch = ItemSketch(epsilon, delta, rse)
+    cursor = collection.find(match or {}, {'_id': 0, 'ip': 1},
+                             batch_size=batch_size)
+    sketch.update(log.get('ip') for log in cursor)
+    return sketch
 
-    status_check_count = collection.count_documents({
-        'method': 'GET',
-        'path': '/status'
-        })
 
-    client.close()
+def approximate_log_stats(collection, methods=METHODS, top_ips=10,
+                          match=None, **bounds):
+    """
+    Same as log_stats, with the top IPs estimated by ip_sketch instead of
+    grouping every distinct IP on the server
+
+    Args:
+        bounds: epsilon, delta, rse and batch_size for ip_sketch
+    """
+    total_logs, method_counts, status_check_count, _ = log_stats(
+        collection, methods, 0, match)
+    sketch = ip_sketch(collection, match=match, **bounds)
+    ips = [{'_id': ip, 'count': count} for ip, count in sketch.top(top_ips)]
+    return total_logs, method_counts, status_check_count, ips
+
+
+def connect_nginx():
+    """
+    Returns logs.nginx on localhost; the default connect of
+    parallel_log_stats
+    """
+    return MongoClient().logs.nginx
+
+
+def _close_client(collection):
+    """Closes the MongoClient of a collection returned by a connect."""
+    database = getattr(collection, 'database', None)
+    if database is not None:
+        database.client.close()
+
+
+def id_ranges(collection, partitions):
+    """
+    Splits the logs into partitions _id ranges of about the same size, at
+    the quantiles of a random sample of _ids
+
+    Returns:
+        list: One {'_id': range} filter per partition, together covering
+        every log
+    """
+    sample = collection.aggregate([
+        {'$sample': {'size': partitions * SAMPLES_PER_PARTITION}},
+        {'$project': {'_id': 1}}
+    ])
+    ids = sorted(log['_id'] for log in sample)
+    bounds = sorted({ids[len(ids) * i // partitions]
+                     for i in range(1, partitions)} if ids else set())
+    ranges = []
+    for low, high in zip([None] + bounds, bounds + [None]):
+        condition = {}
+        if low is not None:
+            condition['$gte'] = low
+        if high is not None:
+            condition['$lt'] = high
+        ranges.append({'_id': condition} if condition else {})
+    return ranges
+
+
+_partition_collection = None
+
+
+def _open_partition_collection(connect):
+    """
+    Connects a worker process to the logs, until the worker exits
+    """
+    global _partition_collection
+    _partition_collection = connect()
+    # Pool workers leave through os._exit, which skips atexit
+    multiprocessing.util.Finalize(None, _close_client,
+                                  args=(_partition_collection,),
+                                  exitpriority=10)
+
+
+def scan_partition(collection, match, batch_size=BATCH_SIZE, parse=None):
+    """
+    Counts the logs matching match from a cursor projected to SCAN_FIELDS
+
+    Args:
+        parse: Optional callable turning each projected log into the
+            document to count
+
+    Returns:
+        tuple: Total logs, Counter of methods, GET /status count and
+        Counter of IPs
+    """
+    total_logs = status_check_count = 0
+    methods, ips = Counter(), Counter()
+    for log in collection.find(match, SCAN_FIELDS, batch_size=batch_size):
+        if parse is not None:
+            log = parse(log)
+        method = log.get('method')
+        total_logs += 1
+        methods[method] += 1
+        ips[log.get('ip')] += 1
+        if method == 'GET' and log.get('path') == '/status':
+            status_check_count += 1
+    return total_logs, methods, status_check_count, ips
+
+
+def _scan_worker_partition(match, batch_size, parse):
+    """Runs scan_partition in a worker process."""
+    return scan_partition(_partition_collection, match, batch_size, parse)
+
+
+def parallel_log_stats(connect=connect_nginx, methods=METHODS, top_ips=0,
+                       processes=None, partitions=None,
+                       batch_size=BATCH_SIZE, parse=None, mp_context=None):
+    """
+    Computes Nginx log stats client-side, scanning _id ranges of the logs
+    in a process pool and merging the partial counts
+
+    Meant for stats the server cannot aggregate, such as fields parsed in
+    Python; otherwise log_stats is cheaper.
+
+    Args:
+        connect: Picklable callable returning the logs collection, called
+            here and once in each worker; the MongoClient of each
+            collection it returns is closed when done with
+        methods (list): Methods to report, in order
+        top_ips (int): Number of most frequent IPs to return, 0 for none
+        processes (int): Worker processes, one per core by default
+        partitions (int): _id ranges to scan, 4 per process by default,
+            so that faster workers pick up more ranges
+        batch_size (int): Logs fetched per round trip
+        parse: Optional picklable callable, see scan_partition
+        mp_context: multiprocessing context of the pool
+
+    Returns:
+        tuple: Same as log_stats
+    """
+    processes = processes or os.cpu_count()
+    collection = connect()
+    try:
+        ranges = id_ranges(collection, partitions or 4 * processes)
+    finally:
+        _close_client(collection)
+    total_logs = status_check_count = 0
+    method_counts, ips = Counter(), Counter()
+    with ProcessPoolExecutor(processes, mp_context,
+                             initializer=_open_partition_collection,
+                             initargs=(connect,)) as pool:
+        for partial in pool.map(_scan_worker_partition, ranges,
+                                [batch_size] * len(ranges),
+                                [parse] * len(ranges)):
+            total_logs += partial[0]
+            method_counts.update(partial[1])
+            status_check_count += partial[2]
+            ips.update(partial[3])
+
+    buckets = ({'_id': method, 'count': count}
+               for method, count in method_counts.items())
+    top = heapq.nsmallest(top_ips, ips.items(),
+                          key=lambda pair: (-pair[1], str(pair[0])))
+    return (total_logs, bucket_methods(buckets, methods), status_check_count,
+            [{'_id': ip, 'count': count} for ip, count in top])
+
+
+def summary_collection(collection):
+    """
+    Returns the summary collection of a logs collection, <name>_stats in
+    the same database
+    """
+    return collection.database[f"{collection.name}_stats"]
+
+
+def update_summary(collection, summary=None, lag=LAG):
+    """
+    Merges the logs inserted since the last checkpoint into the summary
+
+    The summary holds one counter document per method and per IP, keyed
+    {'kind': 'method' | 'ip', 'key': value}, and a CHECKPOINT document
+    with the total, the GET /status count and the high-water mark: the
+    ObjectId of the time up to which logs are counted. Logs are counted
+    up to lag seconds ago only, so that late inserts, whose ObjectIds
+    were generated earlier, still land after the checkpoint.
+
+    The counters and the checkpoint are not written atomically: a run
+    interrupted in between counts its logs twice, which check_summary
+    reports and rebuild_summary repairs.
+
+    Args:
+        collection: PyMongo collection object holding the logs
+        summary: Summary collection, summary_collection() by default
+        lag (int): Seconds the high-water mark stays behind the clock
+
+    Returns:
+        int: Number of logs merged
+    """
+    if summary is None:
+        summary = summary_collection(collection)
+    checkpoint = summary.find_one({'_id': CHECKPOINT}) or {}
+    low = checkpoint.get('high_water')
+    high = ObjectId.from_datetime(
+        datetime.now(timezone.utc) - timedelta(seconds=lag))
+    if low is not None and low >= high:
+        return 0
+    window = {'$lt': high}
+    if low is not None:
+        window['$gte'] = low
+
+    pipeline = [
+        {'$match': {'_id': window}},
+        {'$group': {
+            '_id': {
+                'method': '$method',
+                'ip': '$ip',
+                'status_check': {'$and': [{'$eq': ['$method', 'GET']},
+                                          {'$eq': ['$path', '/status']}]}
+            },
+            'count': {'$sum': 1}
+        }}
+    ]
+    total_logs = status_check_count = 0
+    counters = {'method': Counter(), 'ip': Counter()}
+    for bucket in collection.aggregate(pipeline, allowDiskUse=True):
+        key, count = bucket['_id'], bucket['count']
+        total_logs += count
+        counters['method'][key.get('method')] += count
+        counters['ip'][key.get('ip')] += count
+        if key['status_check']:
+            status_check_count += count
+
+    requests = [
+        UpdateOne({'_id': {'kind': kind, 'key': key}},
+                  {'$inc': {'count': count}}, upsert=True)
+        for kind, counts in counters.items() for key, count in counts.items()
+    ]
+    if requests:
+        summary.create_index([('_id.kind', 1), ('count', -1)])
+        summary.bulk_write(requests, ordered=False)
+    summary.update_one(
+        {'_id': CHECKPOINT},
+        {'$inc': {'total': total_logs, 'status_check': status_check_count},
+         '$set': {'high_water': high}},
+        upsert=True)
+    return total_logs
+
+
+def rebuild_summary(collection, summary=None, lag=LAG):
+    """
+    Recomputes the summary from every log
+
+    Returns:
+        int: Number of logs summarized
+    """
+    if summary is None:
+        summary = summary_collection(collection)
+    summary.drop()
+    return update_summary(collection, summary, lag)
+
+
+def summary_stats(summary, methods=METHODS, top_ips=0):
+    """
+    Reads Nginx log stats from a summary, as of its checkpoint
+
+    Returns:
+        tuple: Same as log_stats
+    """
+    checkpoint = summary.find_one({'_id': CHECKPOINT}) or {}
+    buckets = ({'_id': document['_id']['key'], 'count': document['count']}
+               for document in summary.find({'_id.kind': 'method'}))
+    ips = []
+    if top_ips:
+        cursor = summary.find({'_id.kind': 'ip'}).sort(
+            [('count', -1), ('_id.key', 1)]).limit(top_ips)
+        ips = [{'_id': document['_id']['key'], 'count': document['count']}
+               for document in cursor]
+    return (checkpoint.get('total', 0), bucket_methods(buckets, methods),
+            checkpoint.get('status_check', 0), ips)
+
+
+def check_summary(collection, summary=None, methods=METHODS, top_ips=10):
+    """
+    Compares the summary with a full scan of the logs up to its checkpoint
+
+    Returns:
+        bool: True when both give the same stats
+    """
+    if summary is None:
+        summary = summary_collection(collection)
+    checkpoint = summary.find_one({'_id': CHECKPOINT}) or {}
+    match = None
+    if 'high_water' in checkpoint:
+        match = {'_id': {'$lt': checkpoint['high_water']}}
+    expected = log_stats(collection, methods, top_ips, match)
+    return summary_stats(summary, methods, top_ips) == expected
+
+
+def nginx_log_stats(collection=None, methods=METHODS, incremental=False):
+    """
+    Function to retrieve stats about Nginx logs
+
+    Args:
+        collection: Logs collection, logs.nginx on localhost by default
+        methods (list): Methods to report, in order
+        incremental (bool): Read the stats from the summary collection,
+            updated first, rather than scanning every log
+    """
+    client = None
+    if collection is None:
+        client = MongoClient()
+        collection = client.logs.nginx
+
+    try:
+        if incremental:
+            update_summary(collection)
+            stats = summary_stats(summary_collection(collection), methods)
+        else:
+            stats = log_stats(collection, methods)
+    finally:
+        if client is not None:
+            client.close()
 
+    total_logs, method_counts, status_check_count, _ = stats
     return total_logs, method_counts, status_check_count
 
 
-def print_nginx_stats():
+def print_nginx_stats(incremental=False, parallel=False):
     """
     Function to print stats about Nginx logs
     """
-    total_logs, method_counts, status_check_count = nginx_log_stats()
+    if parallel:
+        total_logs, method_counts, status_check_count, _ = \
+            parallel_log_stats()
+    else:
+        total_logs, method_counts, status_check_count = nginx_log_stats(
+            incremental=incremental)
 
     print(f"{total_logs} logs")
 
@@ -48,4 +475,17 @@ def print_nginx_stats():
 
 
 if __name__ == "__main__":
-    print_nginx_stats()
\ No newline at end of file
+    if sys.argv[1:] in (['--rebuild'], ['--check']):
+        client = MongoClient()
+        try:
+            if sys.argv[1] == '--rebuild':
+                print(f"{rebuild_summary(client.logs.nginx)} logs summarized")
+            elif not check_summary(client.logs.nginx):
+                sys.exit("summary is inconsistent, run with --rebuild")
+            else:
+                print("summary is consistent")
+        finally:
+            client.close()
+    else:
+        print_nginx_stats(incremental='--incremental' in sys.argv[1:],
+                          parallel='--parallel' in sys.argv[1:])
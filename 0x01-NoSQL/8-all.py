@@ -3,6 +3,8 @@
 Module containing function to list all documents in a collection
 """
 
+BATCH_SIZE = 1000
+
 
 def list_all(mongo_collection):
     """
@@ -16,4 +18,58 @@ def list_all(mongo_collection):
     """
     documents = mongo_collection.find({})
     
-    return list(documents)
\ No newline at end of file
+    return list(documents)
+
+
+def iter_documents(mongo_collection, query=None, batch_size=BATCH_SIZE,
+                   projection=None, after=None, page_size=0):
+    """
+    Yields the documents matching query one batch at a time, so memory
+    stays flat whatever the number of documents
+
+    With after or page_size the documents come in _id order, resuming
+    after the _id after (keyset pagination): an iteration cut short can be
+    resumed by passing the _id of the last document seen.
+
+    Args:
+        mongo_collection: PyMongo collection object
+        query (dict): Filter on the documents, all by default
+        batch_size (int): Documents fetched per round trip
+        projection (dict): Optional projection; it must keep _id for
+            keyset pagination
+        after: Only yield documents whose _id is greater
+        page_size (int): Documents per query, each page being a new short
+            query resuming after the previous one, 0 for a single query
+
+    Yields:
+        dict: The matching documents
+    """
+    query = query or {}
+    keyset = after is not None or page_size
+    if keyset and projection and not projection.get('_id', True):
+        raise ValueError("keyset pagination needs the _id field")
+    while True:
+        page = query
+        if after is not None:
+            page = {'$and': [query, {'_id': {'$gt': after}}]}
+        cursor = mongo_collection.find(page, projection,
+                                       batch_size=batch_size)
+        if keyset:
+            cursor = cursor.sort('_id', 1)
+        if page_size:
+            cursor = cursor.limit(page_size)
+        count = 0
+        for document in cursor:
+            count += 1
+            if keyset:
+                after = document['_id']
+            yield document
+        if not page_size or count < page_size:
+            return
+
+
+def iter_all(mongo_collection, **kwargs):
+    """
+    Yields all documents in a collection, see iter_documents for kwargs
+    """
+    return iter_documents(mongo_collection, {}, **kwargs)
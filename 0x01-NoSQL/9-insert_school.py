@@ -2,6 +2,11 @@
 """
 Module containing function to insert a new document in a collection
 """
+from itertools import islice
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+CHUNK_SIZE = 1000
 
 
 def insert_school(mongo_collection, **kwargs):
@@ -15,4 +20,71 @@ def insert_school(mongo_collection, **kwargs):
     Returns:
         str: The _id of the newly inserted document
     """
-    return mongo_collection.insert_one(kwargs).inserted_id
\ No newline at end of file
+    return mongo_collection.insert_one(kwargs).inserted_id
+
+
+def chunks(iterable, chunk_size):
+    """
+    Yields lists of at most chunk_size items of iterable
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def chunk_failure(index, error):
+    """
+    Describes why chunk number index failed, fully or in part
+
+    Returns:
+        dict: The chunk index, the error message and, for bulk write
+        errors, the write errors and write concern errors of the chunk
+    """
+    failure = {'chunk': index, 'error': str(error)}
+    if isinstance(error, BulkWriteError):
+        failure['writeErrors'] = error.details.get('writeErrors', [])
+        failure['writeConcernErrors'] = error.details.get(
+            'writeConcernErrors', [])
+    return failure
+
+
+def insert_schools(mongo_collection, schools, chunk_size=CHUNK_SIZE,
+                   write_concern=None):
+    """
+    Inserts many documents in a collection, chunk_size per round trip
+
+    Chunks are unordered inserts: a document that fails does not stop the
+    others, nor do the failures of a chunk stop the next chunks.
+
+    Args:
+        mongo_collection: PyMongo collection object
+        schools: Iterable of the documents to insert
+        chunk_size (int): Documents per insert_many
+        write_concern: Optional pymongo WriteConcern of the inserts
+
+    Returns:
+        tuple: The list of the _ids inserted and the list of the failures
+        of the chunks, as described by chunk_failure
+    """
+    if write_concern is not None:
+        mongo_collection = mongo_collection.with_options(
+            write_concern=write_concern)
+    inserted_ids = []
+    failures = []
+    for index, chunk in enumerate(chunks(schools, chunk_size)):
+        try:
+            inserted_ids.extend(mongo_collection.insert_many(
+                chunk, ordered=False).inserted_ids)
+        except BulkWriteError as error:
+            failed = {write_error['index']
+                      for write_error in error.details['writeErrors']}
+            inserted_ids.extend(document['_id']
+                                for position, document in enumerate(chunk)
+                                if position not in failed)
+            failures.append(chunk_failure(index, error))
+        except PyMongoError as error:
+            failures.append(chunk_failure(index, error))
+    return inserted_ids, failures
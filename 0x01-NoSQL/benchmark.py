@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the NoSQL helpers, run against an in-process mongomock
+collection loaded from dump.zip. mongomock scans in Python, so only the
+first SAMPLE logs are loaded, and as it runs each $facet branch over its
+own copy of the documents, the scan counts are the figures to read.
+
+Requires ``mongomock``. Run: ./benchmark.py
+"""
+import os
+import random
+import sys
+import time
+import tracemalloc
+import zipfile
+from collections import Counter
+from itertools import islice
+
+import bson
+import mongomock
+
+log_stats = __import__('12-log_stats')
+students = __import__('101-students')
+all_module = __import__('8-all')
+topic_module = __import__('11-schools_by_topic')
+insert_module = __import__('9-insert_school')
+update_module = __import__('10-update_topics')
+log_stream = __import__('log_stream')
+
+DUMP = 'dump.zip'
+NGINX_BSON = 'dump/logs/nginx.bson'
+SAMPLE = 10000
+SYNTHETIC = 1000000
+LATENCY = 0.001
+
+
+class CountingCollection:
+    """
+    Collection proxy that counts the calls to the methods counted: by
+    default the queries, one collection scan each.
+    """
+    SCANS = ('count_documents', 'aggregate', 'find')
+    WRITES = ('insert_one', 'insert_many', 'update_many', 'bulk_write')
+
+    def __init__(self, collection, counted=SCANS):
+        self.collection = collection
+        self.counted = counted
+        self.calls = 0
+
+    def __getattr__(self, name):
+        if name in self.counted:
+            self.calls += 1
+        return getattr(self.collection, name)
+
+
+def load_nginx(collection, limit=None, dump=DUMP):
+    """
+    Loads the first limit logs.nginx documents of dump into collection,
+    all of them by default.
+    """
+    with zipfile.ZipFile(dump) as archive:
+        with archive.open(NGINX_BSON) as data:
+            documents = islice(bson.decode_file_iter(data), limit)
+            collection.insert_many(list(documents))
+
+
+def legacy_log_stats(collection):
+    """
+    The per-query stats: one count_documents per figure, then a $group.
+    """
+    total_logs = collection.count_documents({})
+    method_counts = {method: collection.count_documents({'method': method})
+                     for method in log_stats.METHODS}
+    status_check_count = collection.count_documents(
+        {'method': 'GET', 'path': '/status'})
+    top_ips = list(collection.aggregate([
+        {'$group': {'_id': '$ip', 'count': {'$sum': 1}}},
+        {'$sort': {'count': -1, '_id': 1}},
+        {'$limit': 10}
+    ]))
+    return total_logs, method_counts, status_check_count, top_ips
+
+
+def bench_log_stats(collection):
+    """
+    Compares the per-query stats with the single $facet aggregation.
+    """
+    results = []
+    for label, run in (
+            ('per-query', legacy_log_stats),
+            ('$facet', lambda c: log_stats.log_stats(c, top_ips=10))):
+        counting = CountingCollection(collection)
+        start = time.perf_counter()
+        results.append(run(counting))
+        elapsed = time.perf_counter() - start
+        print("log_stats[{:<9}] {:>8.3f} s {:>3} scans".format(
+            label, elapsed, counting.calls))
+    legacy, facet = results
+    other = facet[1].pop(log_stats.OTHER, 0)
+    assert legacy == facet
+    print("{} logs outside {} were bucketed as {}".format(
+        other, log_stats.METHODS, log_stats.OTHER))
+
+
+def bench_sketches(collection, k=10):
+    """
+    Compares the accuracy and memory of ip_sketch at several error bounds
+    with the exact per-IP counts, and checks that merging the sketches of
+    two halves matches the sketch of the whole.
+    """
+    exact = Counter(log.get('ip') for log in collection.find({}, {'ip': 1}))
+    exact_bytes = sys.getsizeof(exact) + sum(map(sys.getsizeof, exact))
+    exact_top = log_stats.log_stats(collection, top_ips=k)[3]
+    print("exact           {:>9} bytes {:>6} distinct IPs".format(
+        exact_bytes, len(exact)))
+    for epsilon, rse in ((0.01, 0.05), (0.001, 0.01), (0.0001, 0.005)):
+        start = time.perf_counter()
+        sketch = log_stats.ip_sketch(collection, epsilon=epsilon, rse=rse)
+        elapsed = time.perf_counter() - start
+        top = sketch.top(k)
+        recall = len({ip for ip, _ in top}
+                     & {ip_data['_id'] for ip_data in exact_top}) / k
+        error = max(count - exact[ip] for ip, count in top)
+        print("eps={:<6} rse={:<5} {:>9} bytes {:>6} distinct IPs "
+              "top-{} recall {:.0%}, max overcount {} ({:.3f} s)".format(
+                  epsilon, rse, sketch.nbytes(), sketch.distinct(), k,
+                  recall, error, elapsed))
+
+    middle = collection.find_one(skip=collection.count_documents({}) // 2)
+    halves = [log_stats.ip_sketch(collection, match={'_id': condition})
+              for condition in ({'$lt': middle['_id']},
+                                {'$gte': middle['_id']})]
+    halves[0].merge(halves[1])
+    whole = log_stats.ip_sketch(collection)
+    assert halves[0].distinct() == whole.distinct()
+    print("merged halves: top-{} {}, {} distinct IPs".format(
+        k, "same" if halves[0].top(k) == whole.top(k) else "differs",
+        halves[0].distinct()))
+
+
+class TailableCursor:
+    """
+    Stand-in for a TAILABLE_AWAIT cursor over a mongomock collection:
+    next() returns the next log inserted after the last one returned and
+    stops iteration when there is none, staying alive until idle_polls
+    empty polls in a row.
+    """
+
+    def __init__(self, collection, query, idle_polls):
+        self.collection = collection
+        self.query = query
+        self.idle_polls = idle_polls
+        self.alive = True
+        self._skip = 0
+        self._last_id = None
+        self._idle = 0
+
+    def max_await_time_ms(self, max_await_time_ms):
+        """Polls do not wait, mongomock has no awaitData."""
+        return self
+
+    def skip(self, skip):
+        """Skips the first skip logs of the first poll."""
+        self._skip = skip
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        query = self.query
+        if self._last_id is not None:
+            query = {'$and': [query, {'_id': {'$gt': self._last_id}}]}
+        log = next(iter(self.collection.find(query).sort('_id', 1)
+                        .skip(self._skip).limit(1)), None)
+        if log is None:
+            self._idle += 1
+            self.alive = self._idle < self.idle_polls
+            raise StopIteration
+        self._skip, self._last_id, self._idle = 0, log['_id'], 0
+        return log
+
+
+class TailableLogs:
+    """
+    Capped collection stand-in, over a mongomock collection, whose find
+    returns TailableCursor objects; cursors counts those opened.
+    """
+
+    def __init__(self, collection, idle_polls=2):
+        self.collection = collection
+        self.idle_polls = idle_polls
+        self.cursors = 0
+
+    def find(self, query, cursor_type=None):
+        """Opens a tailable cursor over the logs matching query."""
+        self.cursors += 1
+        return TailableCursor(self.collection, query, self.idle_polls)
+
+    def options(self):
+        """Reports the collection as capped, as watch checks."""
+        return {'capped': True}
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def check_tailable_events(collection, n=1000, before=10):
+    """
+    Tails a TailableLogs stand-in with log_stream.tailable_events while
+    replaying n logs of collection into it, the first cursor dying halfway,
+    and checks that every log inserted while tailing is yielded once, and
+    none of the before logs already there.
+    """
+    replayed = [{key: value for key, value in log.items() if key != '_id'}
+                for log in islice(log_stream.replay_events(collection), n)]
+    capped = TailableLogs(mongomock.MongoClient().logs.nginx)
+    capped.insert_many([dict(log) for log in replayed[:before]])
+    events = log_stream.tailable_events(capped, max_await_time_ms=0)
+
+    def drain():
+        """Returns the logs yielded up to the next idle tick."""
+        tailed = []
+        for log in events:
+            if log is None:
+                return tailed
+            tailed.append(log)
+
+    assert drain() == []
+    middle = (before + n) // 2
+    capped.insert_many([dict(log) for log in replayed[before:middle]])
+    tailed = drain()
+    # Idle until the cursor dies and tailable_events resumes
+    for _ in range(capped.idle_polls):
+        next(events)
+    capped.insert_many([dict(log) for log in replayed[middle:]])
+    tailed += drain()
+    events.close()
+
+    assert capped.cursors == 2
+    assert len({log['_id'] for log in tailed}) == len(tailed)
+    assert [{key: value for key, value in log.items() if key != '_id'}
+            for log in tailed] == replayed[before:]
+    print("tailable_events: {} logs tailed across {} cursors".format(
+        len(tailed), capped.cursors))
+
+
+class SyntheticLogs:
+    """
+    Read-only stand-in for a collection of n generated logs, whose _ids
+    are the ObjectIds of 0 to n - 1. Each log is derived from its _id, so
+    any _id range is generated on demand, in flat memory and identically
+    in every process.
+
+    Supports the queries of parallel_log_stats: $sample and _id ranges.
+    """
+    METHODS = ['GET'] * 80 + ['POST'] * 10 + ['PUT'] * 3 + ['PATCH'] * 2 \
+        + ['DELETE'] * 2 + ['HEAD'] * 3
+    PATHS = ('/', '/status', '/api', '/login')
+
+    def __init__(self, n):
+        self.n = n
+
+    def _log(self, i):
+        """Builds log i from a splitmix64 hash of i."""
+        x = (i * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        x ^= x >> 31
+        # Pareto-distributed client, through the inverse CDF
+        client = int((((x >> 32) + 1) / 2 ** 32) ** (-1 / 1.1)) % 65536
+        return {'method': self.METHODS[x % 100],
+                'path': self.PATHS[(x >> 8) % 4],
+                'ip': '10.0.{}.{}'.format(*divmod(client, 256))}
+
+    def find(self, match, projection=None, batch_size=None):
+        """Yields the logs of an {'_id': {'$gte', '$lt'}} range."""
+        condition = match.get('_id', {})
+        low, high = condition.get('$gte'), condition.get('$lt')
+        start = 0 if low is None else int.from_bytes(low.binary, 'big')
+        stop = self.n if high is None else int.from_bytes(high.binary, 'big')
+        return map(self._log, range(start, min(stop, self.n)))
+
+    def aggregate(self, pipeline):
+        """Yields the _ids of a {'$sample': {'size'}} first stage."""
+        size = min(pipeline[0]['$sample']['size'], self.n)
+        for i in random.sample(range(self.n), size):
+            yield {'_id': bson.ObjectId(i.to_bytes(12, 'big'))}
+
+
+def connect_synthetic():
+    """
+    Returns SYNTHETIC generated logs.
+    """
+    return SyntheticLogs(SYNTHETIC)
+
+
+def bench_parallel():
+    """
+    Times parallel_log_stats over SYNTHETIC generated logs with 1, 2, 4,
+    ... up to one process per core.
+    """
+    processes, baseline, expected = 1, None, None
+    while processes <= os.cpu_count():
+        start = time.perf_counter()
+        stats = log_stats.parallel_log_stats(
+            connect_synthetic, top_ips=10, processes=processes)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        expected = expected or stats
+        assert stats == expected
+        print("parallel_log_stats[{:>2} processes] {:>8.3f} s "
+              "speedup {:>5.2f}".format(processes, elapsed,
+                                        baseline / elapsed))
+        processes *= 2
+
+
+def generate_students(n, seed=0):
+    """
+    Yields n students with three scored topics each.
+    """
+    rng = random.Random(seed)
+    for i in range(n):
+        yield {'_id': i, 'name': 'student{}'.format(i),
+               'topics': [{'title': title, 'score': rng.uniform(0, 20)}
+                          for title in ('Algo', 'C', 'Python')]}
+
+
+def legacy_top_students(documents):
+    """
+    The former top_students: every student loaded, averaged, then sorted
+    with the average recomputed as the sort key.
+    """
+    documents = list(documents)
+    for student in documents:
+        students.get_average_score(student)
+    return sorted(documents, key=students.get_average_score, reverse=True)
+
+
+def bench_top_students(sizes=(10000, 1000000), k=10):
+    """
+    Compares the time and peak memory of the former top_students with the
+    heapq top-k path, and checks the aggregation pipeline against them
+    on mongomock at the smallest size.
+    """
+    expected = None
+    for n in sizes:
+        results = []
+        for label, run in (
+                ("sorted list", legacy_top_students),
+                ("heapq top-k", lambda documents:
+                    students.top_students_local(documents, k))):
+            tracemalloc.start()
+            start = time.perf_counter()
+            top = [student['_id'] for student in run(generate_students(n))]
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append(top[:k])
+            print("top_students[{:>7} {:<11}] {:>8.3f} s {:>11} bytes peak"
+                  .format(n, label, elapsed, peak))
+        assert results[0] == results[1]
+        expected = expected or results[0]
+
+    collection = mongomock.MongoClient().my_db.students
+    collection.insert_many(generate_students(sizes[0]))
+    start = time.perf_counter()
+    top = [student['_id'] for student in students.top_students(
+        collection, limit=k, projection={'name': 1})]
+    elapsed = time.perf_counter() - start
+    assert top == expected
+    print("top_students[{:>7} $avg pipeline] {:>6.3f} s on mongomock".format(
+        sizes[0], elapsed))
+
+
+class GeneratedSchools:
+    """
+    Read-only stand-in for a collection of n generated schools with
+    integer _ids, whose cursors, like a server's, hold one batch at a
+    time. mongomock copies every document up front, which would hide the
+    memory profile of the client.
+
+    Supports equality on topics and {'_id': {'$gt'}}, under $and, sort on
+    _id and limit.
+    """
+    TOPICS = ('Algo', 'C', 'Python', 'React', 'MongoDB', 'Javascript')
+
+    def __init__(self, n):
+        self.n = n
+
+    def _school(self, i):
+        """Builds school i."""
+        return {'_id': i, 'name': 'school{}'.format(i),
+                'topics': [topic for j, topic in enumerate(self.TOPICS)
+                           if (i >> j) & 1]}
+
+    def _matches(self, query, school):
+        """Tells whether school matches query."""
+        for field, condition in query.items():
+            if field == '$and':
+                if not all(self._matches(part, school) for part in condition):
+                    return False
+            elif field == '_id':
+                if school['_id'] <= condition['$gt']:
+                    return False
+            elif condition not in school[field]:
+                return False
+        return True
+
+    def find(self, query, projection=None, batch_size=None):
+        """Returns a cursor over the matching schools, in _id order."""
+        return GeneratedCursor(self, query, batch_size or 101)
+
+
+class GeneratedCursor:
+    """
+    Cursor of GeneratedSchools, building one batch at a time.
+    """
+
+    def __init__(self, collection, query, batch_size):
+        self.collection = collection
+        self.query = query
+        self.batch_size = batch_size
+        self.limit_to = 0
+
+    def sort(self, key, direction=1):
+        """Schools are generated in _id order already."""
+        return self
+
+    def limit(self, n):
+        """Stops after n schools."""
+        self.limit_to = n
+        return self
+
+    def __iter__(self):
+        # Seek past {'_id': {'$gt'}} as the _id index would
+        start = 0
+        for part in self.query.get('$and', [self.query]):
+            if '_id' in part:
+                start = part['_id']['$gt'] + 1
+        matches = (school for school in map(self.collection._school,
+                                            range(start, self.collection.n))
+                   if self.collection._matches(self.query, school))
+        if self.limit_to:
+            matches = islice(matches, self.limit_to)
+        while True:
+            batch = list(islice(matches, self.batch_size))
+            if not batch:
+                return
+            yield from batch
+
+
+def bench_streaming(sizes=(10000, 100000, 1000000)):
+    """
+    Compares the peak memory of list_all and schools_by_topic with their
+    streaming variants, consuming every document.
+    """
+    for n in sizes:
+        collection = GeneratedSchools(n)
+        for label, run in (
+                ("list_all", lambda: all_module.list_all(collection)),
+                ("iter_all", lambda: all_module.iter_all(collection)),
+                ("iter_all paged", lambda: all_module.iter_all(
+                    collection, page_size=10000)),
+                ("schools_by_topic", lambda: topic_module.schools_by_topic(
+                    collection, 'Python')),
+                ("iter_schools_by_topic",
+                 lambda: topic_module.iter_schools_by_topic(
+                     collection, 'Python'))):
+            tracemalloc.start()
+            start = time.perf_counter()
+            count = sum(1 for _ in run())
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("{:<22}[{:>7}] {:>7} docs {:>8.3f} s {:>11} bytes peak"
+                  .format(label, n, count, elapsed, peak))
+
+
+def bench_bulk_writes(n=2000, chunk_size=500):
+    """
+    Compares insert_school and update_topics loops with insert_schools and
+    bulk_update_topics, also projecting each run at LATENCY seconds per
+    round trip since mongomock has none. mongomock does not use indexes
+    either, so each update scans every school, hence the small n.
+    """
+    names = ['school{}'.format(i) for i in range(n)]
+    collection = mongomock.MongoClient().my_db.school
+    collection.create_index('name')
+    for label, run in (
+            ("insert_school loop", lambda c: [
+                insert_module.insert_school(c, name=name) for name in names]),
+            ("insert_schools", lambda c: insert_module.insert_schools(
+                c, ({'name': name} for name in names), chunk_size)),
+            ("update_topics loop", lambda c: [
+                update_module.update_topics(c, name, ['Python'])
+                for name in names]),
+            ("bulk_update_topics", lambda c: update_module.bulk_update_topics(
+                c, dict.fromkeys(names, ['C']), chunk_size))):
+        if label.startswith("insert"):
+            collection.delete_many({})
+        counting = CountingCollection(collection, CountingCollection.WRITES)
+        start = time.perf_counter()
+        run(counting)
+        elapsed = time.perf_counter() - start
+        projected = elapsed + counting.calls * LATENCY
+        print("{:<18} {:>8.0f} docs/sec {:>6} round trips, "
+              "{:>8.0f} docs/sec at {} ms".format(
+                  label, n / elapsed, counting.calls, n / projected,
+                  LATENCY * 1000))
+    assert collection.count_documents({'topics': 'C'}) == n
+
+
+if __name__ == "__main__":
+    nginx = mongomock.MongoClient().logs.nginx
+    load_nginx(nginx, SAMPLE)
+    bench_log_stats(nginx)
+    bench_sketches(nginx)
+    check_tailable_events(nginx)
+    bench_parallel()
+    bench_top_students()
+    bench_streaming()
+    bench_bulk_writes()
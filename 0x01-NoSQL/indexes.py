@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Indexes backing the NoSQL query helpers, and a query plan checker
+
+Usage: ./indexes.py [--check]
+
+Creates the indexes of my_db.school, unless --check is given, then
+explains every helper query and exits with an error if any of them scans
+its whole collection (COLLSCAN).
+
+logs.nginx needs no secondary index: the log stats read it whole in one
+$facet aggregation, and their incremental and parallel modes read _id
+ranges, which the _id index serves.
+"""
+import sys
+
+from pymongo import ASCENDING, IndexModel, MongoClient
+
+SCHOOL_INDEXES = [
+    # Multikey: one entry per topic of each school
+    IndexModel([('topics', ASCENDING)], name='topics'),
+    # Also serves prefix regexes such as /^Holberton/
+    IndexModel([('name', ASCENDING)], name='name'),
+]
+
+# Helper name: (collection, filter)
+HELPER_QUERIES = {
+    'schools_by_topic': ('school', {'topics': 'Python'}),
+    'update_topics': ('school', {'name': 'Holberton school'}),
+    '100-find': ('school', {'name': {'$regex': '^Holberton'}}),
+}
+
+
+def ensure_indexes(mongo_collection, indexes):
+    """
+    Creates the indexes missing from a collection
+
+    Creating an index that already exists with the same keys and options
+    does nothing, so this can run at every start.
+
+    Args:
+        mongo_collection: PyMongo collection object
+        indexes (list): IndexModel objects, such as SCHOOL_INDEXES
+
+    Returns:
+        list: The names of the indexes
+    """
+    return mongo_collection.create_indexes(indexes)
+
+
+def ensure_all_indexes(client):
+    """
+    Creates the indexes of my_db.school
+
+    Args:
+        client: PyMongo client
+    """
+    ensure_indexes(client.my_db.school, SCHOOL_INDEXES)
+
+
+def plan_stages(plan):
+    """
+    Yields the stage names of an explain plan, walking its input stages
+    """
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for key in ('inputStage', 'queryPlan', 'winningPlan'):
+            yield from plan_stages(plan.get(key))
+        for stage in plan.get('inputStages', []):
+            yield from plan_stages(stage)
+
+
+def winning_stages(mongo_collection, query):
+    """
+    Returns the stages of the plan the server picks for query
+    """
+    explanation = mongo_collection.find(query).explain()
+    return list(plan_stages(explanation['queryPlanner']['winningPlan']))
+
+
+def check_query_plans(collections, queries=None):
+    """
+    Explains the helper queries and reports those scanning a whole
+    collection
+
+    Args:
+        collections (dict): The PyMongo collection of each collection
+            name of the queries, such as {'school': ...}
+        queries (dict): Helper name: (collection name, filter), all of
+            HELPER_QUERIES by default
+
+    Returns:
+        list: The names of the helpers whose plan has a COLLSCAN stage
+    """
+    collscans = []
+    for helper, (name, query) in (queries or HELPER_QUERIES).items():
+        if 'COLLSCAN' in winning_stages(collections[name], query):
+            collscans.append(helper)
+    return collscans
+
+
+if __name__ == "__main__":
+    client = MongoClient()
+    try:
+        if '--check' not in sys.argv[1:]:
+            ensure_all_indexes(client)
+        collscans = check_query_plans({'school': client.my_db.school})
+    finally:
+        client.close()
+    if collscans:
+        sys.exit("COLLSCAN in: {}".format(", ".join(collscans)))
+    print("every helper query uses an index")
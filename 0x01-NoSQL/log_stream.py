@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Live stats about Nginx logs inserted into MongoDB
+
+Usage: ./log_stream.py
+
+Tails the inserts into logs.nginx, with a change stream or, on a capped
+collection, a tailable cursor, and prints the stats every INTERVAL
+seconds. The top IPs are kept in a Space-Saving sketch, so memory stays
+bounded whatever the number of distinct IPs.
+"""
+import time
+from collections import Counter
+
+from pymongo import CursorType, MongoClient
+
+log_stats = __import__('12-log_stats')
+SpaceSaving = __import__('sketches').SpaceSaving
+
+INTERVAL = 5.0
+TOP_IPS = 10
+
+
+class LiveStats:
+    """
+    Nginx log stats updated one log at a time
+    """
+
+    def __init__(self, methods=log_stats.METHODS, top_ips=TOP_IPS,
+                 capacity=None):
+        """
+        Args:
+            methods (list): Methods to report, in order
+            top_ips (int): Number of most frequent IPs to report
+            capacity (int): IP counters to keep, 10 * top_ips by default
+        """
+        self.methods = methods
+        self.top_ips = top_ips
+        self.total = 0
+        self.method_counts = Counter()
+        self.status_check = 0
+        self.ips = SpaceSaving(capacity or 10 * top_ips)
+
+    def add(self, log):
+        """Counts one log document."""
+        method = log.get('method')
+        self.total += 1
+        self.method_counts[method] += 1
+        if method == 'GET' and log.get('path') == '/status':
+            self.status_check += 1
+        self.ips.add(log.get('ip'))
+
+    def snapshot(self):
+        """
+        Returns:
+            tuple: Same as log_stats in 12-log_stats, the IP counts being
+            upper bounds once more IPs were seen than the sketch holds
+        """
+        buckets = ({'_id': method, 'count': n}
+                   for method, n in self.method_counts.items())
+        ips = [{'_id': ip, 'count': n} for ip, n in self.ips.top(self.top_ips)]
+        return (self.total, log_stats.bucket_methods(buckets, self.methods),
+                self.status_check, ips)
+
+
+def change_stream_events(collection, max_await_time_ms=1000):
+    """
+    Yields the logs inserted into collection as they arrive, and None
+    whenever none arrived for max_await_time_ms, so that consumers can
+    keep publishing while the stream is idle
+    """
+    pipeline = [{'$match': {'operationType': 'insert'}}]
+    with collection.watch(pipeline,
+                          max_await_time_ms=max_await_time_ms) as stream:
+        while stream.alive:
+            change = stream.try_next()
+            yield change['fullDocument'] if change else None
+
+
+def tailable_events(collection, max_await_time_ms=1000):
+    """
+    Yields the logs inserted into a capped collection as they arrive, and
+    None when idle, resuming after the last log seen if the cursor dies
+    """
+    last_id = None
+    while True:
+        query = {} if last_id is None else {'_id': {'$gt': last_id}}
+        cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+        cursor.max_await_time_ms(max_await_time_ms)
+        if last_id is None:
+            # Only the logs inserted from now on
+            cursor.skip(collection.estimated_document_count())
+        while cursor.alive:
+            # A live tailable cursor stops iteration when no log arrived
+            log = next(cursor, None)
+            if log is not None:
+                last_id = log['_id']
+            yield log
+        time.sleep(max_await_time_ms / 1000)
+
+
+def replay_events(collection, query=None, batch_size=1000):
+    """
+    Yields the logs already in collection, as a simulated event source
+    """
+    yield from collection.find(query or {}, batch_size=batch_size)
+
+
+def print_snapshot(snapshot):
+    """
+    Prints stats in the format of 102-log_stats
+    """
+    total_logs, method_counts, status_check_count, top_ips = snapshot
+
+    print(f"{total_logs} logs")
+
+    print("Methods:")
+    for method, count in method_counts.items():
+        print(f"\tmethod {method}: {count}")
+
+    print(f"{status_check_count} status check")
+
+    print("IPs:")
+    for ip_data in top_ips:
+        print(f"\t{ip_data['_id']}: {ip_data['count']}")
+
+
+def store_snapshot(collection):
+    """
+    Returns a publisher replacing the single document of collection with
+    each snapshot, for dashboards to read
+    """
+    def publish(snapshot):
+        total_logs, method_counts, status_check_count, top_ips = snapshot
+        collection.replace_one({'_id': 'live'}, {
+            'total': total_logs,
+            'methods': [{'method': method, 'count': count}
+                        for method, count in method_counts.items()],
+            'status_check': status_check_count,
+            'ips': top_ips,
+            'at': time.time()
+        }, upsert=True)
+    return publish
+
+
+def consume(events, stats=None, publish=print_snapshot, interval=INTERVAL,
+            clock=time.monotonic):
+    """
+    Counts events into stats, publishing a snapshot every interval seconds
+    and once more when events run out
+
+    Args:
+        events: Iterable of log documents, None standing for idle ticks
+        stats (LiveStats): Stats to update, new ones by default
+        publish: Callable given each snapshot
+        interval (float): Seconds between snapshots
+        clock: Monotonic time source
+
+    Returns:
+        LiveStats: The updated stats
+    """
+    if stats is None:
+        stats = LiveStats()
+    published = clock()
+    try:
+        for log in events:
+            if log is not None:
+                stats.add(log)
+            if clock() - published >= interval:
+                publish(stats.snapshot())
+                published = clock()
+    finally:
+        publish(stats.snapshot())
+    return stats
+
+
+def watch(collection, **kwargs):
+    """
+    Consumes the inserts into collection until interrupted, with a
+    tailable cursor if it is capped and a change stream otherwise
+    """
+    if collection.options().get('capped'):
+        events = tailable_events(collection)
+    else:
+        events = change_stream_events(collection)
+    return consume(events, **kwargs)
+
+
+if __name__ == "__main__":
+    client = MongoClient()
+    try:
+        watch(client.logs.nginx)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Memoized schools_by_topic, invalidated by the writes that change it
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import bson
+
+schools_by_topic = __import__('11-schools_by_topic').schools_by_topic
+insert_school = __import__('9-insert_school').insert_school
+update_topics = __import__('10-update_topics').update_topics
+
+TTL = 60
+MAX_TOPICS = 1024
+GENERATION_TTL = 3600
+
+
+class SchoolsCache:
+    """
+    Caches the result of schools_by_topic per topic, for ttl seconds.
+
+    Writes made through insert_school and update_topics invalidate the
+    topics of every document they touch, before and after the write. Each
+    invalidation also bumps the generation of its topics, and a result is
+    only cached if the generation of its topic did not change while it was
+    queried, so a read racing a write never caches stale schools.
+
+    Results are kept in this process, in an LRU of max_topics entries, or
+    in Redis when a client is given, so that every process shares them and
+    their invalidations; Redis then bounds their memory with its own
+    maxmemory policy.
+    """
+
+    def __init__(self, mongo_collection, ttl=TTL, max_topics=MAX_TOPICS,
+                 redis_client=None, prefix=None):
+        """
+        Args:
+            mongo_collection: PyMongo collection object of the schools
+            ttl (int): Seconds a result stays cached
+            max_topics (int): Topics cached in this process
+            redis_client: Optional redis.Redis client to share the cache
+            prefix (str): Redis key prefix, from the collection by default
+        """
+        self.mongo_collection = mongo_collection
+        self.ttl = ttl
+        self.max_topics = max_topics
+        self.redis = redis_client
+        self.prefix = prefix or "schools_by_topic:{}:".format(
+            mongo_collection.full_name)
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.invalidations = 0
+        self.hit_seconds = self.miss_seconds = 0.0
+
+    def schools_by_topic(self, topic):
+        """
+        Returns the list of schools having a specific topic, from the cache
+        when possible
+
+        Args:
+            topic (str): The topic to search for
+
+        Returns:
+            list: List of schools having the specified topic
+        """
+        start = time.perf_counter()
+        data = self._get(topic)
+        if data is not None:
+            schools = bson.decode(data)['schools']
+            with self._lock:
+                self.hits += 1
+                self.hit_seconds += time.perf_counter() - start
+            return schools
+
+        generation = self._generation(topic)
+        schools = schools_by_topic(self.mongo_collection, topic)
+        self._put(topic, bson.encode({'schools': schools}), generation)
+        with self._lock:
+            self.misses += 1
+            self.miss_seconds += time.perf_counter() - start
+        return schools
+
+    def insert_school(self, **kwargs):
+        """
+        Inserts a new document, invalidating its topics
+
+        Returns:
+            The _id of the newly inserted document
+        """
+        try:
+            return insert_school(self.mongo_collection, **kwargs)
+        finally:
+            self.invalidate(kwargs.get('topics') or [])
+
+    def update_topics(self, name, topics):
+        """
+        Changes all topics of the schools named name, invalidating their
+        former topics and the new ones
+        """
+        former = self.mongo_collection.distinct('topics', {'name': name})
+        try:
+            update_topics(self.mongo_collection, name, topics)
+        finally:
+            self.invalidate(set(former) | set(topics))
+
+    def invalidate(self, topics):
+        """
+        Drops the cached schools of topics
+        """
+        topics = list(topics)
+        if not topics:
+            return
+        if self.redis is not None:
+            pipe = self.redis.pipeline(transaction=False)
+            for topic in topics:
+                key = self._key(topic)
+                pipe.incr(key + ':generation')
+                pipe.expire(key + ':generation', GENERATION_TTL)
+                pipe.delete(key)
+            pipe.execute()
+        with self._lock:
+            for topic in topics:
+                self._generations[topic] = self._generations.get(topic, 0) + 1
+                self._entries.pop(topic, None)
+            self.invalidations += len(topics)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hits, misses, invalidations, the hit ratio and the mean
+            latency of hits and misses in milliseconds
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'hit_ms': 1000 * self.hit_seconds / self.hits
+                if self.hits else 0.0,
+                'miss_ms': 1000 * self.miss_seconds / self.misses
+                if self.misses else 0.0,
+            }
+
+    def _key(self, topic):
+        """Returns the Redis key of topic."""
+        return self.prefix + topic
+
+    def _get(self, topic):
+        """Returns the cached BSON of topic, or None."""
+        if self.redis is not None:
+            return self.redis.get(self._key(topic))
+        with self._lock:
+            entry = self._entries.get(topic)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires <= time.monotonic():
+                del self._entries[topic]
+                return None
+            self._entries.move_to_end(topic)
+            return data
+
+    def _generation(self, topic):
+        """Returns the generation of topic."""
+        if self.redis is not None:
+            return self.redis.get(self._key(topic) + ':generation')
+        with self._lock:
+            return self._generations.get(topic, 0)
+
+    def _put(self, topic, data, generation):
+        """Caches data for topic unless topic was invalidated since
+        generation was read."""
+        if self.redis is not None:
+            key = self._key(topic)
+
+            def store(pipe):
+                if pipe.get(key + ':generation') != generation:
+                    return
+                pipe.multi()
+                pipe.setex(key, self.ttl, data)
+            self.redis.transaction(store, key + ':generation')
+            return
+        with self._lock:
+            if self._generations.get(topic, 0) != generation:
+                return
+            self._entries[topic] = (time.monotonic() + self.ttl, data)
+            self._entries.move_to_end(topic)
+            while len(self._entries) > self.max_topics:
+                self._entries.popitem(last=False)
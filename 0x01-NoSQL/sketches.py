@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Bounded-memory summaries of log streams
+"""
+import heapq
+import math
+import sys
+from array import array
+from hashlib import blake2b
+from itertools import count
+
+
+def hash64(item):
+    """
+    Returns a 64-bit hash of item that is stable across processes, so
+    sketches built in different processes can be merged
+    """
+    digest = blake2b(str(item).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class SpaceSaving:
+    """
+    Space-Saving heavy hitters: keeps at most capacity counters, so the
+    top items of an unbounded stream are tracked in bounded memory.
+
+    A counted item is overestimated by at most its error, itself at most
+    the number of items seen divided by capacity; any item seen more often
+    than that is guaranteed to be tracked.
+    """
+
+    def __init__(self, capacity):
+        """
+        Args:
+            capacity (int): Number of counters to keep
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self._heap = []
+        self._sequence = count()
+
+    @classmethod
+    def from_error(cls, epsilon):
+        """
+        Returns a sketch overestimating counts by at most epsilon times the
+        number of items seen
+        """
+        return cls(math.ceil(1 / epsilon))
+
+    def add(self, item, n=1):
+        """
+        Counts n occurrences of item, replacing the smallest counter when
+        item is not tracked and every counter is taken
+        """
+        counts = self.counts
+        if item in counts:
+            counts[item] += n
+        elif len(counts) < self.capacity:
+            counts[item] = n
+            self.errors[item] = 0
+        else:
+            floor, victim = self._pop_min()
+            del counts[victim]
+            del self.errors[victim]
+            counts[item] = floor + n
+            self.errors[item] = floor
+        self._push(item)
+
+    def _push(self, item):
+        """Records the counter of item in the min-heap."""
+        heap = self._heap
+        if len(heap) > 4 * self.capacity:
+            # Drop the stale entries left by increments
+            heap[:] = [(n, next(self._sequence), key)
+                       for key, n in self.counts.items()]
+            heapq.heapify(heap)
+        else:
+            heapq.heappush(heap, (self.counts[item], next(self._sequence),
+                                  item))
+
+    def _pop_min(self):
+        """Pops the smallest counter, skipping stale heap entries."""
+        while True:
+            n, _, item = heapq.heappop(self._heap)
+            if self.counts.get(item) == n:
+                return n, item
+
+    def floor(self):
+        """
+        Returns:
+            int: The count any untracked item may have, 0 until full
+        """
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def merge(self, other):
+        """
+        Adds the counters of other, a sketch of another part of the stream,
+        keeping the capacity largest; items missing from one sketch are
+        credited with its floor, as they may have been evicted from it
+        """
+        floor, other_floor = self.floor(), other.floor()
+        counts, errors = {}, {}
+        for item in self.counts.keys() | other.counts.keys():
+            counts[item] = (self.counts.get(item, floor)
+                            + other.counts.get(item, other_floor))
+            errors[item] = (self.errors.get(item, floor)
+                            + other.errors.get(item, other_floor))
+        kept = heapq.nlargest(self.capacity, counts, key=counts.get)
+        self.counts = {item: counts[item] for item in kept}
+        self.errors = {item: errors[item] for item in kept}
+        self._heap = [(n, next(self._sequence), item)
+                      for item, n in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def top(self, k):
+        """
+        Returns:
+            list: The k largest (item, count) pairs, largest first
+        """
+        return heapq.nsmallest(k, self.counts.items(),
+                               key=lambda pair: (-pair[1], str(pair[0])))
+
+    def nbytes(self):
+        """Returns the approximate memory used by the counters."""
+        return (sys.getsizeof(self.counts) + sys.getsizeof(self.errors)
+                + sys.getsizeof(self._heap)
+                + sum(sys.getsizeof(item) for item in self.counts))
+
+    def __len__(self):
+        return len(self.counts)
+
+
+class CountMin:
+    """
+    Count-Min sketch: estimates the count of any item in depth rows of
+    width counters, overestimating by at most e / width times the number
+    of items seen with probability 1 - e ** -depth
+    """
+
+    def __init__(self, width, depth):
+        """
+        Args:
+            width (int): Counters per row
+            depth (int): Number of rows
+        """
+        if width < 1 or depth < 1:
+            raise ValueError("width and depth must be at least 1")
+        self.width = width
+        self.depth = depth
+        self.rows = [array('q', bytes(8 * width)) for _ in range(depth)]
+
+    @classmethod
+    def from_error(cls, epsilon, delta):
+        """
+        Returns a sketch overestimating counts by at most epsilon times the
+        number of items seen, with probability 1 - delta
+        """
+        return cls(math.ceil(math.e / epsilon), math.ceil(math.log(1 / delta)))
+
+    def _columns(self, item):
+        """Yields the counter index of item in each row."""
+        hashed = hash64(item)
+        low, high = hashed & 0xFFFFFFFF, hashed >> 32
+        for row in range(self.depth):
+            yield (low + row * high) % self.width
+
+    def add(self, item, n=1):
+        """Counts n occurrences of item."""
+        for row, column in zip(self.rows, self._columns(item)):
+            row[column] += n
+
+    def estimate(self, item):
+        """Returns an upper bound of the count of item."""
+        return min(row[column]
+                   for row, column in zip(self.rows, self._columns(item)))
+
+    def merge(self, other):
+        """Adds the counters of other, which must have the same shape."""
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("cannot merge sketches of different shapes")
+        for row, other_row in zip(self.rows, other.rows):
+            for column, n in enumerate(other_row):
+                row[column] += n
+
+    def nbytes(self):
+        """Returns the memory used by the counters."""
+        return sum(row.itemsize * len(row) for row in self.rows)
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter: estimates the number of distinct items
+    in 2 ** precision one-byte registers, with a relative standard error
+    of 1.04 / sqrt(2 ** precision)
+    """
+
+    def __init__(self, precision=14):
+        """
+        Args:
+            precision (int): Register index bits, from 4 to 18
+        """
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @classmethod
+    def from_error(cls, rse):
+        """
+        Returns a counter with a relative standard error of at most rse
+        """
+        return cls(max(4, math.ceil(math.log2((1.04 / rse) ** 2))))
+
+    def add(self, item):
+        """Counts item."""
+        hashed = hash64(item)
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        """Returns the estimated number of distinct items."""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def merge(self, other):
+        """Adds the items of other, which must have the same precision."""
+        if self.precision != other.precision:
+            raise ValueError("cannot merge counters of different precisions")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def nbytes(self):
+        """Returns the memory used by the registers."""
+        return len(self.registers)
+
+
+class ItemSketch:
+    """
+    Approximate frequencies of a stream of items: its heavy hitters, each
+    counted by both a Space-Saving and a Count-Min sketch and reported
+    with the tighter of the two upper bounds, and its distinct count
+    """
+
+    def __init__(self, epsilon=0.001, delta=0.01, rse=0.01):
+        """
+        Args:
+            epsilon (float): Counts are overestimated by at most epsilon
+                times the number of items seen
+            delta (float): Probability of the Count-Min bound not holding
+            rse (float): Relative standard error of the distinct count
+        """
+        self.heavy_hitters = SpaceSaving.from_error(epsilon)
+        self.frequencies = CountMin.from_error(epsilon, delta)
+        self.distinct_items = HyperLogLog.from_error(rse)
+
+    def add(self, item):
+        """Counts item."""
+        self.heavy_hitters.add(item)
+        self.frequencies.add(item)
+        self.distinct_items.add(item)
+
+    def update(self, items):
+        """Counts every item of items."""
+        for item in items:
+            self.add(item)
+
+    def merge(self, other):
+        """
+        Adds the counts of other, built with the same error bounds over
+        another shard or time window
+        """
+        self.heavy_hitters.merge(other.heavy_hitters)
+        self.frequencies.merge(other.frequencies)
+        self.distinct_items.merge(other.distinct_items)
+
+    def top(self, k):
+        """
+        Returns:
+            list: The k most frequent (item, count) pairs, largest first
+        """
+        estimate = self.frequencies.estimate
+        counts = ((item, min(n, estimate(item)))
+                  for item, n in self.heavy_hitters.counts.items())
+        return heapq.nsmallest(k, counts,
+                               key=lambda pair: (-pair[1], str(pair[0])))
+
+    def distinct(self):
+        """Returns the estimated number of distinct items."""
+        return self.distinct_items.count()
+
+    def nbytes(self):
+        """Returns the approximate memory used by the sketches."""
+        return (self.heavy_hitters.nbytes() + self.frequencies.nbytes()
+                + self.distinct_items.nbytes())
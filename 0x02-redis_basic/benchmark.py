@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Cache class, run against an in-process fake Redis.
+
+Requires ``fakeredis``. Run: ./benchmark.py
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import fakeredis
+
+exercise = __import__('exercise')
+
+
+class CountingRedis(fakeredis.FakeRedis):
+    """
+    Fake Redis client that counts network round trips.
+    """
+    round_trips = 0
+
+    def execute_command(self, *args, **kwargs):
+        """Counts one round trip per direct command"""
+        CountingRedis.round_trips += 1
+        return super().execute_command(*args, **kwargs)
+
+    def pipeline(self, *args, **kwargs):
+        """Counts one round trip per executed pipeline"""
+        pipe = super().pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def counted(*a, **kw):
+            if pipe.command_stack:
+                CountingRedis.round_trips += 1
+            return execute(*a, **kw)
+        pipe.execute = counted
+        return pipe
+
+
+def bench_store(mode: str, n: int = 10000) -> None:
+    """
+    Times n calls to Cache.store in the given instrumentation mode.
+    """
+    cache = exercise.Cache(instrumentation=mode, client=CountingRedis(),
+                           clear=True)
+    cache.flush()
+    CountingRedis.round_trips = 0
+    start = time.perf_counter()
+    for i in range(n):
+        cache.store(i)
+    cache.flush()
+    elapsed = time.perf_counter() - start
+    print("store[{:<9}] {:>8.0f} ops/sec {:>6.2f} round trips/call".format(
+        mode, n / elapsed, CountingRedis.round_trips / n))
+
+
+def bench_batch(n: int = 10000, chunk_size: int = 1000) -> None:
+    """
+    Compares store/get loops with the store_many/get_many batch calls.
+    """
+    cache = exercise.Cache(chunk_size=chunk_size, client=CountingRedis(),
+                           clear=True)
+    for label, run in (
+            ("store loop", lambda: [cache.store(i) for i in range(n)]),
+            ("store_many", lambda: cache.store_many(range(n)))):
+        CountingRedis.round_trips = 0
+        start = time.perf_counter()
+        keys = run()
+        elapsed = time.perf_counter() - start
+        print("{:<16} {:>8.0f} ops/sec {:>6} round trips".format(
+            label, n / elapsed, CountingRedis.round_trips))
+    for label, run in (
+            ("get loop", lambda: [cache.get(k, fn=int) for k in keys]),
+            ("get_many", lambda: cache.get_many(keys, fn=int))):
+        CountingRedis.round_trips = 0
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        print("{:<16} {:>8.0f} ops/sec {:>6} round trips".format(
+            label, n / elapsed, CountingRedis.round_trips))
+
+
+def bench_local(n: int = 10000, hot_keys: int = 100) -> None:
+    """
+    Times repeated get_int reads of hot keys with and without a local tier.
+    """
+    for label, local in (("get_int redis", None),
+                         ("get_int local", exercise.LocalCache())):
+        cache = exercise.Cache(local_cache=local, client=CountingRedis(),
+                               clear=True)
+        keys = cache.store_many(range(hot_keys))
+        CountingRedis.round_trips = 0
+        start = time.perf_counter()
+        for i in range(n):
+            cache.get_int(keys[i % hot_keys])
+        elapsed = time.perf_counter() - start
+        print("{:<16} {:>8.0f} ops/sec {:>6} round trips".format(
+            label, n / elapsed, CountingRedis.round_trips))
+
+
+LATENCY = 0.001
+
+
+class SlowRedis(fakeredis.FakeRedis):
+    """
+    Fake Redis client that waits LATENCY seconds per round trip.
+    """
+
+    def execute_command(self, *args, **kwargs):
+        """Sleeps once per direct command"""
+        time.sleep(LATENCY)
+        return super().execute_command(*args, **kwargs)
+
+    def pipeline(self, *args, **kwargs):
+        """Sleeps once per executed pipeline"""
+        pipe = super().pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def slow(*a, **kw):
+            time.sleep(LATENCY)
+            return execute(*a, **kw)
+        pipe.execute = slow
+        return pipe
+
+
+class SlowAsyncRedis(fakeredis.FakeAsyncRedis):
+    """
+    Fake asyncio Redis client that waits LATENCY seconds per round trip.
+    """
+
+    async def execute_command(self, *args, **kwargs):
+        """Sleeps once per direct command"""
+        await asyncio.sleep(LATENCY)
+        return await super().execute_command(*args, **kwargs)
+
+    def pipeline(self, *args, **kwargs):
+        """Sleeps once per executed pipeline"""
+        pipe = super().pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def slow(*a, **kw):
+            await asyncio.sleep(LATENCY)
+            return await execute(*a, **kw)
+        pipe.execute = slow
+        return pipe
+
+
+def bench_concurrency(n: int = 2000) -> None:
+    """
+    Compares AsyncCache tasks with the sync Cache run in a thread pool, at
+    increasing concurrency, with LATENCY seconds per round trip.
+    """
+    sync_cache = exercise.Cache(client=SlowRedis(), clear=True)
+
+    async def run_async(concurrency):
+        client = SlowAsyncRedis(
+            connection_pool_class=exercise.redis.asyncio.BlockingConnectionPool,
+            max_connections=50)
+        cache = exercise.AsyncCache(client=client)
+        per_task = n // concurrency
+
+        async def worker():
+            for i in range(per_task):
+                await cache.get(await cache.store(i))
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        return per_task * concurrency
+
+    def run_sync(concurrency):
+        per_task = n // concurrency
+
+        def worker():
+            for i in range(per_task):
+                sync_cache.get(sync_cache.store(i))
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(worker) for _ in range(concurrency)]:
+                future.result()
+        return per_task * concurrency
+
+    for concurrency in (1, 10, 100, 1000):
+        start = time.perf_counter()
+        done = asyncio.run(run_async(concurrency))
+        async_rate = done / (time.perf_counter() - start)
+        start = time.perf_counter()
+        done = run_sync(concurrency)
+        sync_rate = done / (time.perf_counter() - start)
+        print("{:>5} tasks: async {:>8.0f} ops/sec, threads {:>8.0f} ops/sec"
+              .format(concurrency, async_rate, sync_rate))
+
+
+def bench_codec(n: int = 100000) -> None:
+    """
+    Compares Codec encode/decode with redis-py's str() coercion, per type.
+    """
+    samples = {
+        "int": (123456789, int),
+        "float": (3.14159265, float),
+        "str": ("hello world " * 4, lambda raw: raw.decode("utf-8")),
+        "bytes 8KiB": (bytes(range(256)) * 32, None),
+        "text 8KiB": ("lorem ipsum dolor sit amet " * 300,
+                      lambda raw: raw.decode("utf-8")),
+    }
+    codecs = (("zstd", exercise.Codec("zstd")),
+              ("lz4", exercise.Codec("lz4")))
+    encoder = exercise.redis.connection.Encoder("utf-8", "strict", False)
+    for label, (value, fn) in samples.items():
+        start = time.perf_counter()
+        for _ in range(n):
+            raw = encoder.encode(value)
+            value_back = raw if fn is None else fn(raw)
+        elapsed = time.perf_counter() - start
+        print("{:<11} {:<6} {:>10.0f} ops/sec {:>6} bytes".format(
+            label, "str()", n / elapsed, len(raw)))
+        for name, codec in (("codec", exercise.Codec()),) + codecs:
+            start = time.perf_counter()
+            for _ in range(n):
+                raw = codec.encode(value)
+                value_back = codec.decode(raw)
+            elapsed = time.perf_counter() - start
+            assert value_back == value
+            print("{:<11} {:<6} {:>10.0f} ops/sec {:>6} bytes".format(
+                label, name, n / elapsed, len(raw)))
+
+
+if __name__ == "__main__":
+    for mode in exercise.Cache.MODES:
+        bench_store(mode)
+    bench_batch()
+    bench_local()
+    bench_codec()
+    bench_concurrency()
@@ -3,40 +3,718 @@
 Cache module for Redis operations.
 """
 
+import atexit
+import random
+import re
 import redis
+import redis.asyncio
+import struct
+import threading
+import time
 import uuid
-from typing import Union
-from functools import wraps
+import weakref
+from collections import OrderedDict, defaultdict
+from itertools import islice
+from typing import AsyncIterator, Iterable, Iterator, List, Tuple, Union
+from functools import partial, wraps
 
-class Cache:
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+def _decode_utf8(value) -> str:
+    """
+    Decodes a raw Redis value as UTF-8; values a codec already decoded
+    are converted with str.
+    """
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return str(value)
+
+
+class Codec:
+    """
+    Type-preserving serializer for the values stored by Cache.
+
+    Every encoded value starts with a one-byte header holding its type
+    tag, plus ``COMPRESSED`` when the payload is compressed:
+
+    - bytes are stored as is after the header,
+    - str as UTF-8,
+    - int as a packed signed 64-bit integer (decimal text beyond that),
+    - float as a packed double,
+    - anything else (bool, None, lists, dicts...) with msgpack, which
+      reads tuples back as lists.
+
+    Payloads of at least ``compress_threshold`` bytes are compressed with
+    zstd or lz4 when ``compression`` is set.
+
+    Data without a valid header, such as the call counters Cache keeps
+    next to the stored values, is decoded as the raw bytes it holds.
+    """
+
+    BYTES, STR, INT, BIGINT, FLOAT, MSGPACK = range(6)
+    COMPRESSED = 0x80
+    COMPRESSIONS = (None, "zstd", "lz4")
+
+    _INT = struct.Struct("<q")
+    _FLOAT = struct.Struct("<d")
+    _TAGS = frozenset(range(MSGPACK + 1)).union(
+        range(COMPRESSED, COMPRESSED + MSGPACK + 1))
+
+    def __init__(self, compression: str = None,
+                 compress_threshold: int = 1024) -> None:
+        """
+        Initializes the codec.
+
+        Args:
+            compression: One of ``Codec.COMPRESSIONS``.
+            compress_threshold: Smallest payload size that gets compressed.
+        """
+        if compression not in self.COMPRESSIONS:
+            raise ValueError(
+                "compression must be one of {}".format(self.COMPRESSIONS))
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstd compression requires zstandard")
+        if compression == "lz4" and lz4 is None:
+            raise ImportError("lz4 compression requires lz4")
+        self._compression = compression
+        self._threshold = compress_threshold
+        if compression == "zstd":
+            self._compress = zstandard.ZstdCompressor().compress
+            self._decompress = zstandard.ZstdDecompressor().decompress
+        elif compression == "lz4":
+            self._compress = lz4.frame.compress
+            self._decompress = lz4.frame.decompress
+
+    def encode(self, value) -> bytes:
+        """
+        Encodes value with its type header.
+        """
+        if isinstance(value, bytes):
+            tag, payload = self.BYTES, value
+        elif isinstance(value, str):
+            tag, payload = self.STR, value.encode("utf-8")
+        elif type(value) is int:
+            try:
+                return bytes((self.INT,)) + self._INT.pack(value)
+            except struct.error:
+                tag, payload = self.BIGINT, str(value).encode()
+        elif type(value) is float:
+            return bytes((self.FLOAT,)) + self._FLOAT.pack(value)
+        else:
+            if msgpack is None:
+                raise TypeError("encoding {} requires msgpack".format(
+                    type(value).__name__))
+            tag, payload = self.MSGPACK, msgpack.packb(value)
+        if self._compression is not None and len(payload) >= self._threshold:
+            tag, payload = tag | self.COMPRESSED, self._compress(payload)
+        return bytes((tag,)) + payload
+
+    def decode(self, data: bytes):
+        """
+        Decodes a value produced by ``encode``.
+        """
+        tag = data[0] if data else None
+        if tag not in self._TAGS:
+            return data
+        if tag == self.INT:
+            return self._INT.unpack_from(data, 1)[0]
+        if tag == self.FLOAT:
+            return self._FLOAT.unpack_from(data, 1)[0]
+        # Read the payload in place rather than slicing out a copy
+        payload = memoryview(data)[1:]
+        if tag & self.COMPRESSED:
+            if self._compression is None:
+                raise ValueError("value is compressed but codec is not")
+            tag, payload = tag & ~self.COMPRESSED, self._decompress(payload)
+        if tag == self.BYTES:
+            return bytes(payload)
+        if tag == self.STR:
+            return str(payload, "utf-8")
+        if tag == self.BIGINT:
+            return int(bytes(payload))
+        if tag == self.MSGPACK:
+            if msgpack is None:
+                raise TypeError("decoding requires msgpack")
+            return msgpack.unpackb(payload)
+        raise ValueError("unknown type tag {}".format(tag))
+
+
+class LocalCache:
+    """
+    In-process LRU cache with a TTL and entry/byte bounds.
+
+    Used by Cache as a first tier in front of Redis. Entries are keyed by
+    Redis key and hold the value decoded by each ``fn`` it was read with,
+    so repeated reads skip both the round trip and the decoding. Every
+    method holds a lock, so one LocalCache can be shared by threads.
+    """
+
+    def __init__(self, max_entries: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 ttl: float = 60.0) -> None:
+        """
+        Initializes an empty local cache.
+
+        Args:
+            max_entries: Maximum number of Redis keys held.
+            max_bytes: Maximum total size of the raw values held.
+            ttl: Seconds an entry stays valid, or None for no expiry.
+        """
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, fn=None) -> Tuple[bool, object]:
+        """
+        Looks up the value of key as decoded by fn.
+
+        Returns:
+            A ``(found, value)`` pair.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and \
+                    entry[2] <= time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None or fn not in entry[0]:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[0][fn]
+
+    def set(self, key: str, fn, value, size: int) -> None:
+        """
+        Caches the value of key as decoded by fn.
+
+        Args:
+            key: The Redis key.
+            fn: The decoding callable, or None for the raw value.
+            value: The decoded value.
+            size: Size in bytes of the raw Redis value.
+        """
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                expires = None
+                if self._ttl is not None:
+                    expires = time.monotonic() + self._ttl
+                entry = ({}, size, expires)
+                self._entries[key] = entry
+                self._bytes += size
+            entry[0][fn] = value
+            self._entries.move_to_end(key)
+            while (len(self._entries) > self._max_entries or
+                   self._bytes > self._max_bytes):
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def _drop(self, key: str) -> None:
+        """Drops the entry of key; the lock must be held."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def invalidate(self, key: str) -> None:
+        """
+        Drops every cached value of key.
+        """
+        with self._lock:
+            self._drop(key)
+
+    def clear(self) -> None:
+        """
+        Drops every cached value.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Returns the hit/miss counters and the current size.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self._entries), "bytes": self._bytes}
+
+
+def _flush_at_exit(ref: weakref.ref) -> None:
+    """
+    Flushes a buffered Cache still alive when the interpreter exits.
+    """
+    cache = ref()
+    if cache is not None:
+        cache.flush()
+
+
+class _CacheBase:
+    """
+    State and bookkeeping shared by Cache and AsyncCache.
+
+    The call bookkeeping done by ``count_calls`` and ``call_history`` can
+    run in one of three instrumentation modes:
+
+    - ``"immediate"``: every counter/history update is its own round trip.
+    - ``"pipeline"``: the bookkeeping of one call is sent together with the
+      data write in a single MULTI/EXEC pipeline.
+    - ``"buffered"``: counters and history are kept client-side and flushed
+      every ``flush_every`` calls, or by the first call made once
+      ``flush_interval_ms`` milliseconds have passed, so the hot path only
+      pays for the data write. ``close`` (``aclose`` for AsyncCache)
+      flushes what is left, and so does interpreter exit for a Cache.
+
+    The call history is bounded by a history policy: at most
+    ``history_maxlen`` entries are kept (oldest dropped first), only a
+    ``history_sample`` fraction of calls is recorded, and entries go
+    either to the ``{name}:inputs``/``{name}:outputs`` lists or to a
+    ``{name}:history`` Redis Stream.
+
+    With a ``Codec``, values are stored with a type header and read back
+    as their original type without passing ``fn``.
+
+    With a ``namespace``, every key the cache writes (data, counters and
+    history) is prefixed with ``{namespace}:``, so several caches can share
+    one Redis database, and ``clear`` only removes the keys of its own
+    namespace. Namespaces cannot contain ``:``, so none is nested in
+    another. Keys returned by ``store`` and passed to ``get`` are the
+    unprefixed ones.
+    """
+
+    MODES = ("immediate", "pipeline", "buffered")
+    HISTORY_BACKENDS = ("list", "stream")
+
+    def __init__(self, instrumentation: str = "pipeline",
+                 flush_every: int = 100,
+                 flush_interval_ms: int = 1000,
+                 chunk_size: int = 1000,
+                 history_maxlen: int = None,
+                 history_sample: float = 1.0,
+                 history_backend: str = "list",
+                 local_cache: LocalCache = None,
+                 codec: Codec = None,
+                 namespace: str = "") -> None:
+        """
+        Validates and stores the instrumentation and history options.
+
+        Args:
+            instrumentation: One of ``MODES``.
+            flush_every: Buffered mode flushes after this many calls.
+            flush_interval_ms: Buffered mode flushes when this many
+                milliseconds have passed since the last flush.
+            chunk_size: Default number of keys per pipeline for the
+                ``store_many`` and ``get_many`` batch calls.
+            history_maxlen: Maximum number of history entries kept per
+                method, or None for no cap.
+            history_sample: Probability that a call is recorded in the
+                history; counters are always exact.
+            history_backend: One of ``HISTORY_BACKENDS``.
+            local_cache: Optional in-process tier consulted by ``get``.
+            codec: Optional type-preserving serializer for stored values.
+            namespace: Prefix of every key written by the cache; it must
+                not contain ``:``, the delimiter of the prefix.
+        """
+        if instrumentation not in self.MODES:
+            raise ValueError(
+                "instrumentation must be one of {}".format(self.MODES))
+        if history_backend not in self.HISTORY_BACKENDS:
+            raise ValueError("history_backend must be one of {}".format(
+                self.HISTORY_BACKENDS))
+        if not 0.0 <= history_sample <= 1.0:
+            raise ValueError("history_sample must be between 0 and 1")
+        if ":" in namespace:
+            # "a:*" would also match the keys of a namespace "a:b"
+            raise ValueError("namespace must not contain ':'")
+        self._mode = instrumentation
+        self._flush_every = flush_every
+        self._flush_interval = flush_interval_ms / 1000.0
+        self._chunk_size = chunk_size
+        self._history_maxlen = history_maxlen
+        self._history_sample = history_sample
+        self._history_backend = history_backend
+        self._context = threading.local()
+        self._lock = threading.Lock()
+        self._pending_calls = defaultdict(int)
+        self._pending_history = defaultdict(list)
+        self._pending_count = 0
+        self._last_flush = time.monotonic()
+        self._local = local_cache
+        self._codec = codec
+        self._prefix = "{}:".format(namespace) if namespace else ""
+
+    def _key(self, key: str) -> str:
+        """
+        Returns the Redis key of key in the cache namespace.
+        """
+        return self._prefix + key
+
+    def _scan_pattern(self) -> str:
+        """
+        Returns the SCAN pattern matching every key of the namespace.
+        """
+        return re.sub(r"([*?\[\]\\])", r"\\\1", self._prefix) + "*"
+
+    def _encode(self, value):
+        """
+        Encodes a value to store, when a codec is set.
+        """
+        if self._codec is None:
+            return value
+        return self._codec.encode(value)
+
+    def _decode(self, raw: bytes, fn):
+        """
+        Decodes a stored value with the codec, then applies fn.
+        """
+        value = raw if self._codec is None else self._codec.decode(raw)
+        return value if fn is None else fn(value)
+
+    def _sink(self):
+        """
+        Returns the pipeline of the call in progress, or the client itself.
+        """
+        pipe = getattr(self._context, "pipe", None)
+        return pipe if pipe is not None else self._redis
+
+    def _record_call(self, name: str, n: int = 1, sink=None) -> None:
+        """
+        Records n calls of ``name`` according to the instrumentation mode.
+        """
+        if self._mode == "buffered":
+            with self._lock:
+                self._pending_calls[name] += n
+                self._pending_count += n
+            self._buffered()
+        else:
+            (sink or self._sink()).incrby(self._key(name), n)
+
+    def _record_history(self, name: str, calls: list, sink=None) -> None:
+        """
+        Records the inputs and output of calls of ``name``, subject to
+        the history sampling rate.
+
+        Args:
+            name: The qualified name of the called method.
+            calls: List of ``(args, output)`` pairs, one per call.
+            sink: Client or pipeline to queue on; defaults to ``_sink()``.
+        """
+        if self._history_sample < 1.0:
+            calls = [call for call in calls
+                     if random.random() < self._history_sample]
+        if not calls:
+            return
+        entries = [(str(args), str(output)) for args, output in calls]
+        if self._mode == "buffered":
+            with self._lock:
+                self._pending_history[name].extend(entries)
+            self._buffered()
+        else:
+            self._write_history(sink or self._sink(), name, entries)
+
+    def _write_history(self, sink, name: str,
+                       entries: List[Tuple[str, str]]) -> None:
+        """
+        Queues history entries on sink, trimming to the history cap.
+        """
+        maxlen = self._history_maxlen
+        if self._history_backend == "stream":
+            stream_key = self._key("{}:history".format(name))
+            for inputs, output in entries:
+                sink.xadd(stream_key, {"inputs": inputs, "output": output},
+                          maxlen=maxlen, approximate=False)
+            return
+        inputs_key = self._key("{}:inputs".format(name))
+        outputs_key = self._key("{}:outputs".format(name))
+        sink.rpush(inputs_key, *[inputs for inputs, _ in entries])
+        sink.rpush(outputs_key, *[output for _, output in entries])
+        if maxlen is not None:
+            sink.ltrim(inputs_key, -maxlen, -1)
+            sink.ltrim(outputs_key, -maxlen, -1)
+
+    def _buffered(self) -> None:
+        """
+        Hook run after buffering bookkeeping; flushing is up to the caller.
+        """
+
+    def _flush_due(self) -> bool:
+        """
+        Tells whether the client-side buffers hit a size or time bound.
+        """
+        return self._mode == "buffered" and (
+            self._pending_count >= self._flush_every or
+            time.monotonic() - self._last_flush >= self._flush_interval)
+
+    def _queue_pending(self, pipe) -> bool:
+        """
+        Moves the buffered counters and history onto pipe.
+
+        Returns:
+            Whether anything was queued.
+        """
+        with self._lock:
+            calls, self._pending_calls = self._pending_calls, defaultdict(int)
+            history = self._pending_history
+            self._pending_history = defaultdict(list)
+            self._pending_count = 0
+            self._last_flush = time.monotonic()
+        for name, count in calls.items():
+            pipe.incrby(self._key(name), count)
+        for name, entries in history.items():
+            self._write_history(pipe, name, entries)
+        return bool(calls or history)
+
+    def _queue_store(self, pipe, name: str, values: list) -> List[str]:
+        """
+        Queues the write of values under new keys on pipe, together with
+        their bookkeeping as calls of ``name`` in ``"pipeline"`` mode.
+
+        Returns:
+            The generated keys, in the order of values.
+        """
+        keys = [str(uuid.uuid4()) for _ in values]
+        if len(keys) == 1:
+            pipe.set(self._key(keys[0]), self._encode(values[0]))
+        else:
+            pipe.mset({self._key(key): self._encode(value)
+                       for key, value in zip(keys, values)})
+        sink = pipe if self._mode == "pipeline" else None
+        self._record_call(name, len(values), sink)
+        self._record_history(
+            name, [((value,), key) for value, key in zip(values, keys)], sink)
+        return keys
+
+    def _local_lookup(self, keys: List[str], fn) -> Tuple[list, List[str]]:
+        """
+        Looks keys up in the local tier.
+
+        Returns:
+            The ``(found, value)`` pair of every key, and the keys missed.
+        """
+        found = [self._local.get(key, fn) for key in keys]
+        misses = [key for key, (hit, _) in zip(keys, found) if not hit]
+        return found, misses
+
+    def _local_merge(self, keys: List[str], found: list, misses: List[str],
+                     raws: list, fn) -> list:
+        """
+        Decodes the values fetched for the missed keys, caches them locally
+        and merges them with the local hits.
+
+        Returns:
+            The values of keys, in order.
+        """
+        fetched = {}
+        for key, raw in zip(misses, raws):
+            if raw is None:
+                continue
+            fetched[key] = self._decode(raw, fn)
+            self._local.set(key, fn, fetched[key], len(raw))
+        return [value if hit else fetched.get(key)
+                for key, (hit, value) in zip(keys, found)]
+
+    def _decode_many(self, raws: list, fn) -> list:
+        """
+        Decodes every value that exists.
+        """
+        if fn is None and self._codec is None:
+            return list(raws)
+        return [None if raw is None else self._decode(raw, fn)
+                for raw in raws]
+
+
+class Cache(_CacheBase):
     """
     Cache class for Redis operations.
+
+    See ``_CacheBase`` for the instrumentation modes and history policy.
+
+    Reads can go through an optional ``LocalCache``. Keys made by ``store``
+    are never overwritten, so they are safe to cache for the TTL; with
+    ``client_tracking`` on, Redis also pushes invalidations (CLIENT
+    TRACKING in BCAST mode, optionally limited to ``tracking_prefixes``)
+    so keys that do change are evicted as soon as they are written.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, instrumentation: str = "pipeline",
+                 flush_every: int = 100,
+                 flush_interval_ms: int = 1000,
+                 chunk_size: int = 1000,
+                 history_maxlen: int = None,
+                 history_sample: float = 1.0,
+                 history_backend: str = "list",
+                 local_cache: LocalCache = None,
+                 client_tracking: bool = False,
+                 tracking_prefixes: Iterable[str] = (),
+                 codec: Codec = None,
+                 namespace: str = "",
+                 client: redis.Redis = None,
+                 pool: redis.ConnectionPool = None,
+                 clear: bool = False) -> None:
         """
-        Initializes a Redis client and flushes the instance.
+        Initializes the Redis client, optionally clearing the namespace.
+
+        Args:
+            instrumentation: One of ``Cache.MODES``.
+            flush_every: Buffered mode flushes after this many calls.
+            flush_interval_ms: Buffered mode flushes when this many
+                milliseconds have passed since the last flush.
+            chunk_size: Default number of keys per pipeline for the
+                ``store_many`` and ``get_many`` batch calls.
+            history_maxlen: Maximum number of history entries kept per
+                method, or None for no cap.
+            history_sample: Probability that a call is recorded in the
+                history; counters are always exact.
+            history_backend: One of ``Cache.HISTORY_BACKENDS``.
+            local_cache: Optional in-process tier consulted by ``get``.
+            client_tracking: Subscribe to Redis invalidation messages to
+                evict changed keys from ``local_cache``.
+            tracking_prefixes: Key prefixes tracked for invalidation;
+                defaults to the namespace, or every key without one.
+            codec: Optional type-preserving serializer for stored values.
+            namespace: Prefix of every key written by the cache.
+            client: Client to share instead of creating one.
+            pool: Connection pool for the client created here.
+            clear: Remove the keys of the namespace on construction.
         """
-        self._redis = redis.Redis()
-        self._redis.flushdb()
+        super().__init__(instrumentation, flush_every, flush_interval_ms,
+                         chunk_size, history_maxlen, history_sample,
+                         history_backend, local_cache, codec, namespace)
+        self._owns_client = client is None
+        if client is None:
+            client = redis.Redis(connection_pool=pool)
+        self._redis = client
+        if clear:
+            self.clear()
+        self._invalidations = None
+        if local_cache is not None and client_tracking:
+            if not tracking_prefixes and self._prefix:
+                tracking_prefixes = (self._prefix,)
+            self._enable_tracking(tracking_prefixes)
+        self._at_exit = None
+        if self._mode == "buffered":
+            # The buffers are only flushed by calls, so flush them on exit
+            self._at_exit = partial(_flush_at_exit, weakref.ref(self))
+            atexit.register(self._at_exit)
 
-    def store(self, data: Union[str, bytes, int, float]) -> str:
+    def close(self) -> None:
         """
-        Stores the input data in Redis with a randomly generated key.
+        Flushes buffered bookkeeping and closes the connections of the
+        cache. A client passed to the constructor is left open for its
+        other users.
+        """
+        self.flush()
+        if self._at_exit is not None:
+            atexit.unregister(self._at_exit)
+            self._at_exit = None
+        if self._invalidations is not None:
+            self._invalidations.disconnect()
+            self._tracker.disconnect()
+            self._invalidations = None
+        if self._owns_client:
+            self._redis.close()
+
+    def clear(self, count: int = 1000) -> int:
+        """
+        Removes every key of the namespace with SCAN and UNLINK, so other
+        namespaces and the rest of the database are left alone.
 
         Args:
-            data: The data to be stored.
+            count: SCAN batch size hint.
 
         Returns:
-            The randomly generated key.
+            The number of keys removed.
         """
-        key = str(uuid.uuid4())
-        self._redis.set(key, data)
-        return key
+        removed = 0
+        batch = []
+        for key in self._redis.scan_iter(match=self._scan_pattern(),
+                                         count=count):
+            batch.append(key)
+            if len(batch) >= count:
+                removed += self._redis.unlink(*batch)
+                batch = []
+        if batch:
+            removed += self._redis.unlink(*batch)
+        if self._local is not None:
+            self._local.clear()
+        return removed
+
+    def _enable_tracking(self, prefixes: Iterable[str]) -> None:
+        """
+        Opens a connection subscribed to the invalidation channel and turns
+        on broadcast tracking redirected to it.
+        """
+        pool = self._redis.connection_pool
+        self._invalidations = pool.make_connection()
+        self._invalidations.connect()
+        self._invalidations.send_command("CLIENT", "ID")
+        client_id = self._invalidations.read_response()
+        self._invalidations.send_command("SUBSCRIBE", "__redis__:invalidate")
+        self._invalidations.read_response()
+
+        self._tracker = pool.make_connection()
+        self._tracker.connect()
+        args = ["CLIENT", "TRACKING", "ON", "REDIRECT", client_id, "BCAST"]
+        for prefix in prefixes:
+            args.extend(["PREFIX", prefix])
+        self._tracker.send_command(*args)
+        self._tracker.read_response()
+
+    def _drain_invalidations(self) -> None:
+        """
+        Applies the invalidation messages received so far to the local tier.
+        """
+        if self._invalidations is None:
+            return
+        while self._invalidations.can_read(timeout=0):
+            message = self._invalidations.read_response()
+            keys = message[2]
+            if keys is None:
+                self._local.clear()
+                continue
+            for key in keys:
+                key = key.decode("utf-8")
+                if key.startswith(self._prefix):
+                    self._local.invalidate(key[len(self._prefix):])
+
+    def _buffered(self) -> None:
+        """
+        Flushes the client-side buffers once a size or time bound is hit.
+        """
+        if self._flush_due():
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes buffered counters and history to Redis in one pipeline.
+        """
+        pipe = self._redis.pipeline(transaction=True)
+        if self._queue_pending(pipe):
+            pipe.execute()
 
     def get(self, key: str, fn=None):
         """
-        Retrieves the value associated with the given key from Redis.
+        Retrieves the value associated with the given key from Redis,
+        or from the local tier when it holds it.
 
         Args:
             key: The key to retrieve the value for.
@@ -45,9 +723,17 @@ class Cache:
         Returns:
             The retrieved value.
         """
-        value = self._redis.get(key)
-        if value is not None and fn is not None:
-            return fn(value)
+        if self._local is not None:
+            self._drain_invalidations()
+            found, value = self._local.get(key, fn)
+            if found:
+                return value
+        raw = self._redis.get(self._key(key))
+        if raw is None:
+            return None
+        value = self._decode(raw, fn)
+        if self._local is not None:
+            self._local.set(key, fn, value, len(raw))
         return value
 
     def get_str(self, key: str) -> Union[str, None]:
@@ -60,7 +746,7 @@ class Cache:
         Returns:
             The retrieved value as a string.
         """
-        return self.get(key, fn=lambda x: x.decode("utf-8"))
+        return self.get(key, fn=_decode_utf8)
 
     def get_int(self, key: str) -> Union[int, None]:
         """
@@ -74,14 +760,69 @@ class Cache:
         """
         return self.get(key, fn=int)
 
+    def get_many(self, keys: Iterable[str], fn=None,
+                 chunk_size: int = None) -> list:
+        """
+        Retrieves the values of many keys with one MGET per chunk.
+
+        Args:
+            keys: The keys to retrieve, in any iterable.
+            fn: Optional callable applied to every value that exists.
+            chunk_size: Keys per MGET of the keys missing from the local
+                tier; defaults to the Cache chunk size.
+
+        Returns:
+            The retrieved values, in the order of ``keys``.
+        """
+        chunk_size = chunk_size or self._chunk_size
+        values = []
+        keys = iter(keys)
+        while True:
+            chunk = list(islice(keys, chunk_size))
+            if not chunk:
+                break
+            if self._local is None:
+                raws = self._redis.mget([self._key(key) for key in chunk])
+                values.extend(self._decode_many(raws, fn))
+                continue
+            self._drain_invalidations()
+            found, misses = self._local_lookup(chunk, fn)
+            raws = []
+            if misses:
+                raws = self._redis.mget([self._key(key) for key in misses])
+            values.extend(
+                self._local_merge(chunk, found, misses, raws, fn))
+        return values
+
+    def pipelined(method):
+        """
+        Decorator that sends all Redis writes of one call in one round trip.
+
+        Only takes effect in ``"pipeline"`` mode; the other modes call the
+        method directly.
+        """
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            context = self._context
+            if (self._mode != "pipeline" or
+                    getattr(context, "pipe", None) is not None):
+                return method(self, *args, **kwargs)
+            context.pipe = self._redis.pipeline(transaction=True)
+            try:
+                output = method(self, *args, **kwargs)
+                context.pipe.execute()
+            finally:
+                context.pipe = None
+            return output
+        return wrapper
+
     def count_calls(method):
         """
         Decorator to count the number of times a method is called.
         """
         @wraps(method)
         def wrapper(self, *args, **kwargs):
-            key = method.__qualname__
-            self._redis.incr(key)
+            self._record_call(method.__qualname__)
             return method(self, *args, **kwargs)
         return wrapper
 
@@ -91,32 +832,64 @@ class Cache:
         """
         @wraps(method)
         def wrapper(self, *args, **kwargs):
-            inputs_key = "{}:inputs".format(method.__qualname__)
-            outputs_key = "{}:outputs".format(method.__qualname__)
-
-            self._redis.rpush(inputs_key, str(args))
             output = method(self, *args, **kwargs)
-            self._redis.rpush(outputs_key, str(output))
-
+            self._record_history(method.__qualname__, [(args, output)])
             return output
         return wrapper
 
-    def replay(method):
+    def history(self, method,
+                page_size: int = 100) -> Iterator[Tuple[bytes, bytes]]:
         """
-        Function to display the history of calls of a particular function.
+        Lazily yields the recorded (inputs, output) pairs of a method.
+
+        Args:
+            method: The instrumented method.
+            page_size: Number of entries fetched per round trip.
+
+        Yields:
+            The recorded entries, oldest first.
         """
-        inputs_key = "{}:inputs".format(method.__qualname__)
-        outputs_key = "{}:outputs".format(method.__qualname__)
+        self.flush()
+        name = method.__qualname__
+        if self._history_backend == "stream":
+            stream_key = self._key("{}:history".format(name))
+            start = "-"
+            while True:
+                page = self._redis.xrange(stream_key, min=start,
+                                          count=page_size)
+                for _, fields in page:
+                    yield fields[b"inputs"], fields[b"output"]
+                if len(page) < page_size:
+                    return
+                start = "(" + page[-1][0].decode()
+        inputs_key = self._key("{}:inputs".format(name))
+        outputs_key = self._key("{}:outputs".format(name))
+        start = 0
+        while True:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.lrange(inputs_key, start, start + page_size - 1)
+            pipe.lrange(outputs_key, start, start + page_size - 1)
+            inputs, outputs = pipe.execute()
+            yield from zip(inputs, outputs)
+            if len(inputs) < page_size:
+                return
+            start += page_size
 
-        inputs = method._redis.lrange(inputs_key, 0, -1)
-        outputs = method._redis.lrange(outputs_key, 0, -1)
+    def replay(self, method):
+        """
+        Function to display the history of calls of a particular function.
+        """
+        self.flush()
+        calls = self._redis.get(self._key(method.__qualname__)) or 0
 
-        print("{} was called {} times:".format(method.__qualname__, len(inputs)))
+        print("{} was called {} times:".format(method.__qualname__, int(calls)))
 
-        for args, output in zip(inputs, outputs):
+        for args, output in self.history(method):
             print("{}(*{}) -> {}".format(method.__qualname__, args, output))
 
+    @pipelined
     @count_calls
+    @call_history
     def store(self, data: Union[str, bytes, int, float]) -> str:
         """
         Stores the input data in Redis with a randomly generated key.
@@ -128,11 +901,140 @@ class Cache:
             The randomly generated key.
         """
         key = str(uuid.uuid4())
-        self._redis.set(key, data)
+        self._sink().set(self._key(key), self._encode(data))
         return key
 
-    @call_history
-    def store(self, data: Union[str, bytes, int, float]) -> str:
+    def store_many(self, data: Iterable[Union[str, bytes, int, float]],
+                   chunk_size: int = None) -> List[str]:
+        """
+        Stores many values, each under a randomly generated key.
+
+        The input is consumed ``chunk_size`` items at a time, each chunk
+        being written with one MSET pipeline, so generators are never fully
+        materialized. Every item is counted and recorded in the history of
+        ``Cache.store`` as if it had been stored on its own.
+
+        Args:
+            data: The values to be stored.
+            chunk_size: Values per pipeline; defaults to the Cache chunk size.
+
+        Returns:
+            The generated keys, in the order of ``data``.
+        """
+        chunk_size = chunk_size or self._chunk_size
+        name = self.store.__qualname__
+        keys = []
+        data = iter(data)
+        while True:
+            chunk = list(islice(data, chunk_size))
+            if not chunk:
+                break
+            pipe = self._redis.pipeline(transaction=True)
+            keys.extend(self._queue_store(pipe, name, chunk))
+            pipe.execute()
+        return keys
+
+
+class AsyncCache(_CacheBase):
+    """
+    asyncio variant of Cache built on ``redis.asyncio``.
+
+    Every coroutine mirrors the Cache method of the same name, so awaiting
+    it never blocks the event loop. Connections come from a blocking,
+    size-bounded pool: when all ``max_connections`` are busy, callers wait
+    for one to be released instead of opening more. Pass the same
+    ``client`` to several instances to share one pool between them.
+
+    Writes always go through a pipeline, so only the ``"pipeline"`` and
+    ``"buffered"`` instrumentation modes are available. The
+    ``count_calls`` and ``call_history`` decorators take coroutine methods.
+    """
+
+    MODES = ("pipeline", "buffered")
+
+    def __init__(self, instrumentation: str = "pipeline",
+                 flush_every: int = 100,
+                 flush_interval_ms: int = 1000,
+                 chunk_size: int = 1000,
+                 history_maxlen: int = None,
+                 history_sample: float = 1.0,
+                 history_backend: str = "list",
+                 local_cache: LocalCache = None,
+                 client: redis.asyncio.Redis = None,
+                 max_connections: int = 50,
+                 codec: Codec = None,
+                 namespace: str = "",
+                 pool: redis.asyncio.ConnectionPool = None) -> None:
+        """
+        Initializes the asyncio client; see Cache for the other options.
+
+        Args:
+            client: Client to use instead of creating one.
+            max_connections: Size of the pool of a client created here.
+            pool: Connection pool to use instead of creating one.
+        """
+        super().__init__(instrumentation, flush_every, flush_interval_ms,
+                         chunk_size, history_maxlen, history_sample,
+                         history_backend, local_cache, codec, namespace)
+        owns_client = client is None
+        if client is None:
+            if pool is None:
+                pool = redis.asyncio.BlockingConnectionPool(
+                    max_connections=max_connections)
+            client = redis.asyncio.Redis(connection_pool=pool)
+        self._owns_client = owns_client
+        self._redis = client
+
+    async def aclose(self) -> None:
+        """
+        Flushes buffered bookkeeping and closes the client. A client
+        passed to the constructor is left open for its other users.
+        """
+        await self.flush()
+        if self._owns_client:
+            await self._redis.aclose()
+
+    async def clear(self, count: int = 1000) -> int:
+        """
+        Removes every key of the namespace with SCAN and UNLINK.
+
+        Args:
+            count: SCAN batch size hint.
+
+        Returns:
+            The number of keys removed.
+        """
+        removed = 0
+        batch = []
+        async for key in self._redis.scan_iter(match=self._scan_pattern(),
+                                               count=count):
+            batch.append(key)
+            if len(batch) >= count:
+                removed += await self._redis.unlink(*batch)
+                batch = []
+        if batch:
+            removed += await self._redis.unlink(*batch)
+        if self._local is not None:
+            self._local.clear()
+        return removed
+
+    async def flush(self) -> None:
+        """
+        Writes buffered counters and history to Redis in one pipeline.
+        """
+        pipe = self._redis.pipeline(transaction=True)
+        if self._queue_pending(pipe):
+            await pipe.execute()
+
+    async def _write(self, pipe) -> None:
+        """
+        Executes pipe, then flushes the buffers if a bound was hit.
+        """
+        await pipe.execute()
+        if self._flush_due():
+            await self.flush()
+
+    async def store(self, data: Union[str, bytes, int, float]) -> str:
         """
         Stores the input data in Redis with a randomly generated key.
 
@@ -142,12 +1044,187 @@ class Cache:
         Returns:
             The randomly generated key.
         """
-        key = str(uuid.uuid4())
-        self._redis.set(key, data)
+        pipe = self._redis.pipeline(transaction=self._mode == "pipeline")
+        key, = self._queue_store(pipe, self.store.__qualname__, [data])
+        await self._write(pipe)
         return key
 
+    async def store_many(self, data: Iterable[Union[str, bytes, int, float]],
+                         chunk_size: int = None) -> List[str]:
+        """
+        Stores many values, each under a randomly generated key.
+
+        Args:
+            data: The values to be stored.
+            chunk_size: Values per pipeline; defaults to the chunk size.
+
+        Returns:
+            The generated keys, in the order of ``data``.
+        """
+        chunk_size = chunk_size or self._chunk_size
+        name = self.store.__qualname__
+        keys = []
+        data = iter(data)
+        while True:
+            chunk = list(islice(data, chunk_size))
+            if not chunk:
+                break
+            pipe = self._redis.pipeline(transaction=True)
+            keys.extend(self._queue_store(pipe, name, chunk))
+            await self._write(pipe)
+        return keys
+
+    async def get(self, key: str, fn=None):
+        """
+        Retrieves the value associated with the given key, from the local
+        tier when it holds it.
+
+        Args:
+            key: The key to retrieve the value for.
+            fn: Optional callable to convert the data back to desired format.
+
+        Returns:
+            The retrieved value.
+        """
+        if self._local is not None:
+            found, value = self._local.get(key, fn)
+            if found:
+                return value
+        raw = await self._redis.get(self._key(key))
+        if raw is None:
+            return None
+        value = self._decode(raw, fn)
+        if self._local is not None:
+            self._local.set(key, fn, value, len(raw))
+        return value
+
+    async def get_str(self, key: str) -> Union[str, None]:
+        """
+        Retrieves the value associated with the given key as a string.
+        """
+        return await self.get(key, fn=_decode_utf8)
+
+    async def get_int(self, key: str) -> Union[int, None]:
+        """
+        Retrieves the value associated with the given key as an integer.
+        """
+        return await self.get(key, fn=int)
+
+    async def get_many(self, keys: Iterable[str], fn=None,
+                       chunk_size: int = None) -> list:
+        """
+        Retrieves the values of many keys with one MGET per chunk.
+
+        Args:
+            keys: The keys to retrieve, in any iterable.
+            fn: Optional callable applied to every value that exists.
+            chunk_size: Keys per MGET; defaults to the chunk size.
+
+        Returns:
+            The retrieved values, in the order of ``keys``.
+        """
+        chunk_size = chunk_size or self._chunk_size
+        values = []
+        keys = iter(keys)
+        while True:
+            chunk = list(islice(keys, chunk_size))
+            if not chunk:
+                break
+            if self._local is None:
+                raws = await self._redis.mget(
+                    [self._key(key) for key in chunk])
+                values.extend(self._decode_many(raws, fn))
+                continue
+            found, misses = self._local_lookup(chunk, fn)
+            raws = []
+            if misses:
+                raws = await self._redis.mget(
+                    [self._key(key) for key in misses])
+            values.extend(
+                self._local_merge(chunk, found, misses, raws, fn))
+        return values
+
+    def count_calls(method):
+        """
+        Decorator to count the number of times a coroutine method is called.
+        """
+        @wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            pipe = self._redis.pipeline(transaction=False)
+            self._record_call(method.__qualname__, sink=pipe)
+            await self._write(pipe)
+            return await method(self, *args, **kwargs)
+        return wrapper
+
+    def call_history(method):
+        """
+        Decorator to store the history of inputs and outputs for a
+        coroutine method.
+        """
+        @wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            output = await method(self, *args, **kwargs)
+            pipe = self._redis.pipeline(transaction=False)
+            self._record_history(method.__qualname__, [(args, output)],
+                                 sink=pipe)
+            await self._write(pipe)
+            return output
+        return wrapper
+
+    async def history(self, method, page_size: int = 100
+                      ) -> AsyncIterator[Tuple[bytes, bytes]]:
+        """
+        Lazily yields the recorded (inputs, output) pairs of a method.
+
+        Args:
+            method: The instrumented method.
+            page_size: Number of entries fetched per round trip.
+
+        Yields:
+            The recorded entries, oldest first.
+        """
+        await self.flush()
+        name = method.__qualname__
+        if self._history_backend == "stream":
+            stream_key = self._key("{}:history".format(name))
+            start = "-"
+            while True:
+                page = await self._redis.xrange(stream_key, min=start,
+                                                count=page_size)
+                for _, fields in page:
+                    yield fields[b"inputs"], fields[b"output"]
+                if len(page) < page_size:
+                    return
+                start = "(" + page[-1][0].decode()
+        inputs_key = self._key("{}:inputs".format(name))
+        outputs_key = self._key("{}:outputs".format(name))
+        start = 0
+        while True:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.lrange(inputs_key, start, start + page_size - 1)
+            pipe.lrange(outputs_key, start, start + page_size - 1)
+            inputs, outputs = await pipe.execute()
+            for entry in zip(inputs, outputs):
+                yield entry
+            if len(inputs) < page_size:
+                return
+            start += page_size
+
+    async def replay(self, method) -> None:
+        """
+        Displays the history of calls of a particular function.
+        """
+        await self.flush()
+        calls = await self._redis.get(self._key(method.__qualname__)) or 0
+
+        print("{} was called {} times:".format(method.__qualname__, int(calls)))
+
+        async for args, output in self.history(method):
+            print("{}(*{}) -> {}".format(method.__qualname__, args, output))
+
+
 if __name__ == "__main__":
-    cache = Cache()
+    cache = Cache(clear=True)
 
     # Task 0: Writing strings to Redis
     data = b"hello"
@@ -192,4 +1269,4 @@ if __name__ == "__main__":
     cache.store("foo")
     cache.store("bar")
     cache.store(42)
-    cache.replay(cache.store)
\ No newline at end of file
+    cache.replay(cache.store)
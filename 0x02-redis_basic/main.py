@@ -3,7 +3,7 @@
 
 Cache = __import__('exercise').Cache
 
-cache = Cache()
+cache = Cache(clear=True)
 
 s1 = cache.store("first")
 print(s1)
@@ -1,31 +1,494 @@
 #!/usr/bin/env python3
 """
 Web cache and tracker
+
+A page is cached in a ``meta:{url}`` hash holding its raw body,
+zlib-compressed above COMPRESS_THRESHOLD bytes, together with its
+charset, its ETag/Last-Modified validators and the time it stays fresh
+until, so that one HSET writes and one HGETALL reads a consistent entry.
+The hash outlives freshness by STALE_TTL seconds so that a stale page is
+revalidated with a conditional GET, a 304 only extending its freshness.
+Only 2xx responses are cached; a 5xx keeps serving the stale copy.
 """
+import asyncio
+import codecs
+import math
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from itertools import islice
+from typing import AsyncIterator, Callable, Iterable, Iterator, Optional, \
+    Tuple
+
 import requests
 import redis
+import redis.asyncio
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+EXPIRATION = 10
+STALE_TTL = 3600
+COMPRESS_THRESHOLD = 1024
+TIMEOUT = 5
+LOCK_TIMEOUT = 10
+BETA = 1.0
+CHUNK_SIZE = 1000
+
+_redis = None
+_async_redis = None
+_session = None
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def configure(client: redis.Redis = None,
+              session: requests.Session = None,
+              async_client: redis.asyncio.Redis = None) -> None:
+    """
+    Sets the Redis clients and HTTP session shared by every call.
+
+    They are created on first use when not configured.
+    """
+    global _redis, _session, _async_redis
+    if client is not None:
+        _redis = client
+    if session is not None:
+        _session = session
+    if async_client is not None:
+        _async_redis = async_client
+
+
+def _client() -> redis.Redis:
+    """Returns the shared Redis client."""
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis()
+    return _redis
+
+
+def _async_client() -> redis.asyncio.Redis:
+    """Returns the shared asyncio Redis client."""
+    global _async_redis
+    if _async_redis is None:
+        _async_redis = redis.asyncio.Redis()
+    return _async_redis
+
+
+def _http() -> requests.Session:
+    """Returns the shared keep-alive HTTP session."""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
+def _single_flight(url: str, fetch: Callable[[], str],
+                   wait: bool = True) -> Optional[str]:
+    """
+    Runs fetch for url unless another thread already is, in which case
+    waits for its result (or returns None at once when wait is False).
+    """
+    with _inflight_lock:
+        future = _inflight.get(url)
+        leader = future is None
+        if leader:
+            future = _inflight[url] = Future()
+    if not leader:
+        return future.result() if wait else None
+    try:
+        result = fetch()
+        future.set_result(result)
+        return result
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[url]
+
+
+def _lifetime(headers, expiration: Optional[int]) -> Optional[int]:
+    """
+    Returns how many seconds a response stays fresh, or None when it must
+    not be cached.
+
+    ``no-store`` always wins; otherwise an explicit expiration is used,
+    then ``s-maxage``/``max-age``, then EXPIRATION. ``no-cache`` makes the
+    page stale at once, so every read revalidates it.
+    """
+    directives = {}
+    for directive in headers.get("Cache-Control", "").lower().split(","):
+        name, _, value = directive.strip().partition("=")
+        directives[name] = value.strip('"')
+    if "no-store" in directives:
+        return None
+    if expiration is not None:
+        return expiration
+    if "no-cache" in directives:
+        return 0
+    for name in ("s-maxage", "max-age"):
+        if directives.get(name, "").isdigit():
+            return int(directives[name])
+    return EXPIRATION
+
+
+def _validators(body: Optional[bytes], meta: dict) -> dict:
+    """
+    Returns the conditional request headers for a cached page.
+    """
+    headers = {}
+    if body is None:
+        return headers
+    if meta.get(b"etag"):
+        headers["If-None-Match"] = meta[b"etag"].decode()
+    if meta.get(b"last_modified"):
+        headers["If-Modified-Since"] = meta[b"last_modified"].decode()
+    return headers
+
+
+def _charset(encoding: Optional[str]) -> str:
+    """
+    Returns encoding if Python knows it, utf-8 otherwise, so that a bogus
+    charset from an origin does not make its page undecodable.
+    """
+    try:
+        return codecs.lookup(encoding).name
+    except (LookupError, TypeError):
+        return "utf-8"
+
+
+def _text(body: bytes, meta: dict) -> str:
+    """
+    Decodes a cached body into the page text.
+    """
+    if meta.get(b"compressed") == b"1":
+        body = zlib.decompress(body)
+    encoding = _charset(meta.get(b"encoding", b"utf-8").decode())
+    return body.decode(encoding, errors="replace")
+
+
+def _fresh_for(meta: dict) -> float:
+    """
+    Returns how many seconds a cached page stays fresh; negative if stale.
+    """
+    if b"fresh_until" not in meta:
+        return -1.0
+    return float(meta[b"fresh_until"]) - time.time()
+
+
+def _fetch(session: requests.Session, url: str, timeout: float,
+           validators: dict = None) -> tuple:
+    """
+    Fetches url, conditionally when validators are given.
+
+    Returns:
+        ``(status, content, encoding, headers, delta)``, delta being how
+        long the fetch took.
+    """
+    start = time.monotonic()
+    response = session.get(url, headers=validators, timeout=timeout)
+    encoding = _charset(response.encoding or response.apparent_encoding)
+    return (response.status_code, response.content, encoding,
+            response.headers, time.monotonic() - start)
+
+
+def _queue_store(pipe, url: str, fetched: tuple, body: Optional[bytes],
+                 meta: dict, expiration: Optional[int]) -> str:
+    """
+    Queues the caching of a fetch result on pipe.
+
+    Args:
+        fetched: The result of ``_fetch``.
+        body: The cached body the fetch revalidated, if any.
+        meta: The metadata of that cached body.
+        expiration: Explicit freshness lifetime, or None to follow
+            Cache-Control.
 
-def get_page(url: str) -> str:
+    Returns:
+        The page text.
+    """
+    status, content, encoding, headers, delta = fetched
+    encoding = _charset(encoding)
+    meta_key = "meta:{}".format(url)
+    lifetime = _lifetime(headers, expiration)
+    if status == 304 and body is not None:
+        if lifetime is None:
+            pipe.delete(meta_key)
+        else:
+            pipe.hset(meta_key, mapping={
+                "fresh_until": time.time() + lifetime, "delta": delta})
+            pipe.expire(meta_key, lifetime + STALE_TTL)
+        return _text(body, meta)
+
+    if not 200 <= status < 300:
+        # Never cache an error; a failing origin keeps the stale copy
+        if status >= 500 and body is not None:
+            return _text(body, meta)
+        return content.decode(encoding, errors="replace")
+    if lifetime is None:
+        pipe.delete(meta_key)
+        return content.decode(encoding, errors="replace")
+    compressed = len(content) >= COMPRESS_THRESHOLD
+    # Every field is written, absent validators as empty strings, so the
+    # single HSET replaces the whole entry at once
+    pipe.hset(meta_key, mapping={
+        "body": zlib.compress(content) if compressed else content,
+        "encoding": encoding, "compressed": int(compressed),
+        "fresh_until": time.time() + lifetime, "delta": delta,
+        "etag": headers.get("ETag", ""),
+        "last_modified": headers.get("Last-Modified", "")})
+    pipe.expire(meta_key, lifetime + STALE_TTL)
+    return content.decode(encoding, errors="replace")
+
+
+def _unpack(meta: dict) -> Tuple[Optional[bytes], dict]:
+    """Splits a cached entry into its body and its metadata."""
+    return meta.pop(b"body", None), meta
+
+
+def _read(r, url: str) -> Tuple[Optional[bytes], dict]:
+    """Reads the cached body and metadata of url."""
+    return _unpack(r.hgetall("meta:{}".format(url)))
+
+
+def _fill(url: str, expiration: Optional[int], timeout: float,
+          wait: bool = True) -> Optional[str]:
+    """
+    Fetches or revalidates url and caches it under a Redis lock, so only
+    one process fetches it at a time.
+
+    Callers that wait for the lock re-check the cache once they hold it
+    and return what the previous holder stored. With wait False, returns
+    None when another process holds the lock.
+    """
+    r = _client()
+    lock = r.lock("lock:{}".format(url), timeout=LOCK_TIMEOUT, sleep=0.05)
+    acquired = lock.acquire(blocking=wait, blocking_timeout=LOCK_TIMEOUT)
+    if not acquired and not wait:
+        return None
+    try:
+        body, meta = _read(r, url)
+        if wait and body is not None and _fresh_for(meta) > 0:
+            return _text(body, meta)
+
+        fetched = _fetch(_http(), url, timeout, _validators(body, meta))
+
+        pipe = r.pipeline(transaction=False)
+        page_content = _queue_store(pipe, url, fetched, body, meta,
+                                    expiration)
+        pipe.execute()
+        return page_content
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except redis.exceptions.LockError:
+                pass
+
+
+def _should_refresh(delta: float, ttl: float) -> bool:
+    """
+    Tells whether to refresh a cached page early (XFetch): the closer the
+    expiry and the slower the last fetch, the likelier a refresh. BETA
+    above 1 favours earlier refreshes.
+    """
+    return delta * BETA * -math.log(1.0 - random.random()) >= ttl
+
+
+def _refresh(url: str, expiration: Optional[int], timeout: float) -> None:
+    """
+    Refreshes url in a background thread unless a refresh is running.
+    """
+    def fetch():
+        return _fill(url, expiration, timeout, wait=False)
+
+    threading.Thread(target=_single_flight, args=(url, fetch, False),
+                     daemon=True).start()
+
+
+def get_page(url: str, expiration: int = None,
+             timeout: float = TIMEOUT) -> str:
     """
     Function to obtain the HTML content of a URL and cache it with expiration time.
+
+    The expiration defaults to the response's Cache-Control max-age, then
+    to EXPIRATION seconds. Concurrent misses for the same URL are
+    coalesced: one thread per process, and one process across the Redis
+    lock, fetches the page while the others wait for its result. Cached
+    pages may be refreshed in the background shortly before they expire,
+    so hot URLs rarely miss.
     """
-    r = redis.Redis()
+    r = _client()
     count_key = "count:{}".format(url)
-    page_key = "page:{}".format(url)
 
-    # Increment access count
-    r.incr(count_key)
+    # Increment access count and check the cache in one round trip
+    pipe = r.pipeline(transaction=False)
+    pipe.incr(count_key)
+    pipe.hgetall("meta:{}".format(url))
+    _, entry = pipe.execute()
+    body, meta = _unpack(entry)
 
-    # Check if page is cached
-    cached_page = r.get(page_key)
-    if cached_page:
-        return cached_page.decode("utf-8")
+    if body is not None:
+        fresh_for = _fresh_for(meta)
+        if fresh_for > 0:
+            if _should_refresh(float(meta.get(b"delta", 0)), fresh_for):
+                _refresh(url, expiration, timeout)
+            return _text(body, meta)
+
+    page_content = _single_flight(url, lambda: _fill(url, expiration, timeout))
+    if page_content is None:
+        # Joined a background refresh that found another process fetching
+        page_content = _fill(url, expiration, timeout)
+    return page_content
+
+
+def _chunks(urls: Iterable[str], chunk_size: int) -> Iterator[Counter]:
+    """
+    Yields the distinct urls of each run of chunk_size urls, in order,
+    with their number of occurrences.
+    """
+    urls = iter(urls)
+    while True:
+        chunk = Counter(islice(urls, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _queue_counts(pipe, chunk: Counter) -> None:
+    """Queues the access count increments of chunk."""
+    for url, accesses in chunk.items():
+        pipe.incrby("count:{}".format(url), accesses)
+
+
+def _queue_lookup(pipe, chunk: Iterable[str]) -> None:
+    """Queues the reads of the cached bodies and metadata of chunk."""
+    for url in chunk:
+        pipe.hgetall("meta:{}".format(url))
+
+
+def _split_lookup(chunk: Iterable[str],
+                  results: list) -> Tuple[list, dict]:
+    """
+    Splits the cache lookup of chunk into fresh pages and the cached
+    bodies and metadata of the urls to fetch or revalidate.
+    """
+    fresh = []
+    stale = {}
+    for url, entry in zip(chunk, results):
+        body, meta = _unpack(entry)
+        if body is not None and _fresh_for(meta) > 0:
+            fresh.append((url, _text(body, meta)))
+        else:
+            stale[url] = (body, meta)
+    return fresh, stale
+
+
+def get_pages(urls: Iterable[str], concurrency: int = 10,
+              expiration: int = None, timeout: float = TIMEOUT,
+              chunk_size: int = CHUNK_SIZE
+              ) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Obtains many pages, yielding ``(url, content)`` pairs as they complete.
+
+    urls are handled chunk_size at a time: the cache of a chunk is read in
+    one round trip and its fresh pages yielded first, the rest are fetched
+    or revalidated by ``concurrency`` threads sharing a keep-alive session,
+    and the fetched pages and access counts are written back with one
+    pipeline. Repeated urls within a chunk are fetched once but counted
+    once per occurrence. A url whose fetch fails is yielded with None
+    content, and the other urls are still fetched and cached.
+    """
+    r = _client()
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency,
+                                            pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    with session, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for chunk in _chunks(urls, chunk_size):
+            pipe = r.pipeline(transaction=False)
+            _queue_lookup(pipe, chunk)
+            fresh, stale = _split_lookup(chunk, pipe.execute())
+            yield from fresh
+
+            write_back = r.pipeline(transaction=False)
+            futures = {
+                pool.submit(_fetch, session, url, timeout,
+                            _validators(*cached)): url
+                for url, cached in stale.items()}
+            try:
+                for future in as_completed(futures):
+                    url = futures[future]
+                    try:
+                        fetched = future.result()
+                    except requests.RequestException:
+                        yield url, None
+                        continue
+                    yield url, _queue_store(write_back, url, fetched,
+                                            *stale[url], expiration)
+            finally:
+                _queue_counts(write_back, chunk)
+                write_back.execute()
+
+
+async def get_pages_async(urls: Iterable[str], concurrency: int = 10,
+                          expiration: int = None,
+                          timeout: float = TIMEOUT,
+                          chunk_size: int = CHUNK_SIZE
+                          ) -> AsyncIterator[Tuple[str, Optional[str]]]:
+    """
+    asyncio version of ``get_pages`` built on aiohttp and redis.asyncio.
+
+    At most ``concurrency`` connections are open to the origins at once.
+    """
+    if aiohttp is None:
+        raise ImportError("get_pages_async requires aiohttp")
+    r = _async_client()
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
 
-    # Fetch page content
-    response = requests.get(url)
-    page_content = response.text
+    async def fetch(session, url, validators):
+        start = time.monotonic()
+        try:
+            async with session.get(url, headers=validators) as response:
+                content = await response.read()
+                encoding = _charset(
+                    response.get_encoding() if content else None)
+                return url, (response.status, content, encoding,
+                             response.headers, time.monotonic() - start)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return url, None
 
-    # Cache page content with expiration time
-    r.setex(page_key, 10, page_content)
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=client_timeout) as session:
+        for chunk in _chunks(urls, chunk_size):
+            pipe = r.pipeline(transaction=False)
+            _queue_lookup(pipe, chunk)
+            fresh, stale = _split_lookup(chunk, await pipe.execute())
+            for page in fresh:
+                yield page
 
-    return page_content
\ No newline at end of file
+            write_back = r.pipeline(transaction=False)
+            tasks = [asyncio.ensure_future(
+                fetch(session, url, _validators(*cached)))
+                for url, cached in stale.items()]
+            try:
+                for task in asyncio.as_completed(tasks):
+                    url, fetched = await task
+                    if fetched is None:
+                        yield url, None
+                        continue
+                    yield url, _queue_store(write_back, url, fetched,
+                                            *stale[url], expiration)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                _queue_counts(write_back, chunk)
+                await write_back.execute()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Checks for the web module, run against a local HTTP stub server and an
+in-process fake Redis.
+
+Requires ``fakeredis``. Run: ./web_check.py
+"""
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fakeredis
+
+web = __import__('web')
+
+ETAG = '"v1"'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Origin stub: /slow answers after DELAY seconds, /etag answers 304 to
+    requests carrying its ETag, /bogus declares an unknown charset,
+    /flaky fails with a 503 after its first request and /missing is a
+    404. hits counts the requests of each path,
+    conditional those carrying If-None-Match.
+    """
+    DELAY = 0.2
+    hits = Counter()
+    conditional = Counter()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        """Serves one request of the stub."""
+        with self.lock:
+            self.hits[self.path] += 1
+            if self.headers.get("If-None-Match"):
+                self.conditional[self.path] += 1
+        if self.path == "/slow":
+            time.sleep(self.DELAY)
+        if self.path == "/etag" and self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            self.send_header("Cache-Control", "max-age=60")
+            self.end_headers()
+            return
+        body = "page {}".format(self.path).encode()
+        if self.path == "/flaky" and self.hits[self.path] > 1:
+            self.send_error(503)
+            return
+        self.send_response(404 if self.path == "/missing" else 200)
+        charset = "bogus" if self.path == "/bogus" else "utf-8"
+        self.send_header("Content-Type", "text/html; charset=" + charset)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "max-age=60")
+        if self.path == "/etag":
+            self.send_header("ETag", ETAG)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Keeps the output to the check results."""
+
+
+def check_single_flight(base: str, r: fakeredis.FakeRedis,
+                        n: int = 20) -> None:
+    """
+    Checks that n concurrent get_page calls of a missing page make one
+    origin request, and all return its content.
+    """
+    url = base + "/slow"
+    barrier = threading.Barrier(n)
+
+    def call(_):
+        barrier.wait()
+        return web.get_page(url)
+
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        pages = list(pool.map(call, range(n)))
+    assert pages == ["page /slow"] * n, pages
+    assert StubHandler.hits["/slow"] == 1, StubHandler.hits
+    assert int(r.get("count:{}".format(url))) == n
+    print("single flight: {} callers, {} origin request".format(
+        n, StubHandler.hits["/slow"]))
+
+
+def check_revalidation(base: str, r: fakeredis.FakeRedis) -> None:
+    """
+    Checks that a stale page is revalidated with a conditional GET, and
+    that the 304 only extends its freshness: the cached body, validators
+    and encoding are kept.
+    """
+    url = base + "/etag"
+    meta_key = "meta:{}".format(url)
+    assert web.get_page(url) == "page /etag"
+    meta = r.hgetall(meta_key)
+    assert meta[b"etag"] == ETAG.encode()
+
+    # Make the page stale without waiting for it
+    r.hset(meta_key, "fresh_until", time.time() - 1)
+    r.expire(meta_key, 5)
+    assert web.get_page(url) == "page /etag"
+    assert StubHandler.hits["/etag"] == 2
+    assert StubHandler.conditional["/etag"] == 1
+
+    revalidated = r.hgetall(meta_key)
+    assert float(revalidated[b"fresh_until"]) > time.time() + 50
+    assert r.ttl(meta_key) > 60
+    for field in (b"body", b"encoding", b"compressed", b"etag"):
+        assert revalidated[field] == meta[field], field
+    print("revalidation: 304 kept the body and extended freshness by "
+          "{:.0f} s".format(float(revalidated[b"fresh_until"]) - time.time()))
+
+
+def check_charset(base: str, r: fakeredis.FakeRedis) -> None:
+    """
+    Checks that a page declaring an unknown charset is decoded and cached
+    as utf-8, by get_page as well as get_pages.
+    """
+    url = base + "/bogus"
+    assert web.get_page(url) == "page /bogus"
+    assert r.hget("meta:{}".format(url), "encoding") == b"utf-8"
+    r.hset("meta:{}".format(url), "encoding", "bogus")
+    assert web.get_page(url) == "page /bogus"
+    r.delete("meta:{}".format(url))
+    assert list(web.get_pages([url])) == [(url, "page /bogus")]
+    print("charset: unknown charset decoded as utf-8")
+
+
+def check_errors(base: str, r: fakeredis.FakeRedis) -> None:
+    """
+    Checks that error responses are never cached: a 5xx answering the
+    revalidation of a stale page serves and keeps the stale copy, and a
+    404 is returned without being stored.
+    """
+    url = base + "/flaky"
+    meta_key = "meta:{}".format(url)
+    assert web.get_page(url) == "page /flaky"
+    r.hset(meta_key, "fresh_until", time.time() - 1)
+    cached = r.hgetall(meta_key)
+    assert web.get_page(url) == "page /flaky"
+    assert list(web.get_pages([url])) == [(url, "page /flaky")]
+    assert StubHandler.hits["/flaky"] == 3
+    assert r.hgetall(meta_key) == cached
+
+    url = base + "/missing"
+    assert web.get_page(url) == "page /missing"
+    assert not r.exists("meta:{}".format(url))
+    print("errors: 503 served the stale copy, 404 not cached")
+
+
+def check_early_refresh(base: str) -> None:
+    """
+    Checks that a fresh hit picked for early refresh returns the cached
+    page at once and revalidates it in the background.
+    """
+    url = base + "/etag"
+    before = StubHandler.hits["/etag"]
+    beta, web.BETA = web.BETA, 1e9
+    try:
+        assert web.get_page(url) == "page /etag"
+    finally:
+        web.BETA = beta
+    deadline = time.monotonic() + 5
+    while StubHandler.hits["/etag"] == before and \
+            time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert StubHandler.hits["/etag"] == before + 1
+    print("early refresh: fresh hit revalidated in the background")
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = "http://127.0.0.1:{}".format(server.server_port)
+    r = fakeredis.FakeRedis()
+    web.configure(client=r)
+    # No early refresh unless checked, so origin hits are deterministic
+    web.BETA = 0.0
+    try:
+        check_single_flight(base, r)
+        check_revalidation(base, r)
+        check_charset(base, r)
+        check_errors(base, r)
+        check_early_refresh(base)
+    finally:
+        server.shutdown()